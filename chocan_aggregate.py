@@ -0,0 +1,137 @@
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: the pure-Python reduction gives the same totals
+    np = None
+
+# Column view of one period's records, as produced by RecordStore.columns().
+# fee_cents holds the fee charged when the claim was recorded, or -1 when
+# unknown (records written before fees were stored), which falls back to
+# the catalog fee.
+Columns = namedtuple("Columns", (
+    "provider_numbers", "service_codes", "provider_ids", "service_ids",
+    "service_dates", "fee_cents",
+))
+
+def fee_to_cents(fee):
+    return round(fee * 100)
+
+def _catalog_cents(columns, services):
+    return [
+        fee_to_cents(services[code].fee) if code in services else 0
+        for code in columns.service_codes
+    ]
+
+def _lookup_id(values, value):
+    try:
+        return values.index(value)
+    except ValueError:
+        return None
+
+def _as_numpy(column, size):
+    # tobytes() copies in one step, so the live array is never left exporting
+    # a buffer (which would block appends) and a concurrent append cannot tear it
+    return np.frombuffer(column.tobytes(), dtype=np.dtype(column.typecode))[:size]
+
+def _totals_numpy(columns, catalog, provider_id, service_id, start, end):
+    # Columns grow one at a time while claims are recorded; use the rows all of them have
+    size = min(len(columns.provider_ids), len(columns.service_ids),
+               len(columns.service_dates), len(columns.fee_cents))
+    providers = _as_numpy(columns.provider_ids, size)
+    services = _as_numpy(columns.service_ids, size)
+    dates = _as_numpy(columns.service_dates, size)
+    fees = _as_numpy(columns.fee_cents, size).astype(np.int64)
+    unknown = fees < 0
+    if unknown.any():
+        fees = np.where(unknown, np.asarray(catalog, dtype=np.int64)[services], fees)
+
+    mask = np.ones(len(providers), dtype=bool)
+    if provider_id is not None:
+        mask &= providers == provider_id
+    if service_id is not None:
+        mask &= services == service_id
+    if start is not None:
+        mask &= dates >= start
+    if end is not None:
+        mask &= dates <= end
+
+    selected = providers[mask]
+    size = len(columns.provider_numbers)
+    counts = np.bincount(selected, minlength=size)
+    # Float weights sum whole cents exactly up to 2**53, far beyond any weekly total
+    cents = np.rint(np.bincount(selected, weights=fees[mask], minlength=size)).astype(np.int64)
+    return counts, cents
+
+def _totals_python(columns, catalog, provider_id, service_id, start, end):
+    size = len(columns.provider_numbers)
+    counts = array("q", bytes(8 * size))
+    cents = array("q", bytes(8 * size))
+    for provider, service, service_date, fee in zip(
+        columns.provider_ids, columns.service_ids, columns.service_dates, columns.fee_cents
+    ):
+        if provider_id is not None and provider != provider_id:
+            continue
+        if service_id is not None and service != service_id:
+            continue
+        if (start is not None and service_date < start) or (end is not None and service_date > end):
+            continue
+        counts[provider] += 1
+        cents[provider] += fee if fee >= 0 else catalog[service]
+    return counts, cents
+
+def _provider_totals(columns, services, provider_number, service_code, start, end,
+                     use_numpy):
+    # (consultations, cents) arrays indexed by provider ID, or None when nothing can match
+    provider_id = service_id = None
+    if provider_number is not None:
+        provider_id = _lookup_id(columns.provider_numbers, provider_number)
+        if provider_id is None:
+            return None
+    if service_code is not None:
+        service_id = _lookup_id(columns.service_codes, service_code)
+        if service_id is None:
+            return None
+
+    catalog = _catalog_cents(columns, services)
+    if use_numpy is None:
+        use_numpy = np is not None
+    reduce = _totals_numpy if use_numpy else _totals_python
+    return reduce(columns, catalog, provider_id, service_id, start, end)
+
+def group_by_provider(columns, services, provider_number=None, service_code=None,
+                    start=None, end=None, use_numpy=None):
+    """
+    Group records by provider and return {provider_number: (consultations,
+    fee total in cents)}, optionally only for one provider, one service
+    code or service dates from start to end (ordinals). Uses NumPy when
+    it is installed unless use_numpy says otherwise.
+    """
+    return {
+        number: (consultations, cents)
+        for number, consultations, cents in iter_by_provider(
+            columns, services, provider_number, service_code, start, end, use_numpy,
+            ordered=False
+        )
+    }
+
+def iter_by_provider(columns, services, provider_number=None, service_code=None,
+                     start=None, end=None, use_numpy=None, ordered=True):
+    """
+    Yield (provider_number, consultations, fee total in cents) one provider
+    at a time, in provider number order unless ordered=False, with the same
+    filters as group_by_provider. Per provider this keeps only machine
+    integers (totals and the ID order), never a tuple or dict entry.
+    """
+    totals = _provider_totals(columns, services, provider_number, service_code, start, end,
+                              use_numpy)
+    if totals is None:
+        return
+    counts, cents = totals
+    numbers = columns.provider_numbers
+    ids = array("l", (i for i in range(len(numbers)) if counts[i]))
+    if ordered:
+        ids = array("l", sorted(ids, key=numbers.__getitem__))
+    for i in ids:
+        yield numbers[i], int(counts[i]), int(cents[i])
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import json
+import os
+import threading
+import zlib
+from chocan_records import RecordStore
+
+class SegmentArchive:
+    """
+    Closed periods as immutable, zlib-compressed segments of RecordStore
+    columns, one per period. A small catalog keeps each segment's record
+    count and its member, provider and service date ranges, so a query
+    only opens segments that can hold matches. Without a directory the
+    compressed segments are kept in memory.
+    """
+
+    def __init__(self, directory=None, cache_size=4):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.catalog = {}  # key: period, value: segment index entry
+        self.blobs = {}  # key: period, value: compressed bytes (no directory only)
+        self.cache = OrderedDict()  # key: period, value: decoded RecordStore
+        self.lock = threading.Lock()
+        if directory is not None and os.path.exists(self._catalog_path()):
+            with open(self._catalog_path()) as f:
+                self.catalog = {entry["period"]: entry for entry in json.load(f)}
+
+    def _catalog_path(self):
+        return os.path.join(self.directory, "segments.json")
+
+    def _segment_path(self, period):
+        return os.path.join(self.directory, f"segment_{period:06d}.seg")
+
+    def _write_atomic(self, path, data):
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def write(self, period, store):
+        """Compress a closed period's records into a new segment"""
+        data = zlib.compress(json.dumps(store.to_state(), separators=(",", ":")).encode(), 6)
+        members = store.member_numbers.values
+        providers = store.provider_numbers.values
+        dates = store.service_dates
+        entry = {
+            "period": period,
+            "records": len(store),
+            "bytes": len(data),
+            "members": [min(members), max(members)] if members else None,
+            "providers": [min(providers), max(providers)] if providers else None,
+            "dates": [min(dates), max(dates)] if len(dates) else None,
+        }
+        with self.lock:
+            if self.directory is None:
+                self.blobs[period] = data
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                self._write_atomic(self._segment_path(period), data)
+            self.catalog[period] = entry
+            if self.directory is not None:
+                self._write_atomic(self._catalog_path(), json.dumps(
+                    [self.catalog[p] for p in sorted(self.catalog)], separators=(",", ":")
+                ).encode())
+        return entry
+
+    # Worker processes get the catalog and segments, not the lock or decoded cache
+    def __getstate__(self):
+        return {"directory": self.directory, "cache_size": self.cache_size,
+                "catalog": self.catalog, "blobs": self.blobs}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, period):
+        return period in self.catalog
+
+    def load(self, period):
+        """Return a closed period's RecordStore, decoding the segment on first use"""
+        with self.lock:
+            store = self.cache.get(period)
+            if store is not None:
+                self.cache.move_to_end(period)
+                return store
+            if period not in self.catalog:
+                raise KeyError(period)
+            if self.directory is None:
+                data = self.blobs[period]
+            else:
+                with open(self._segment_path(period), "rb") as f:
+                    data = f.read()
+            store = RecordStore.from_state(json.loads(zlib.decompress(data)))
+            self.cache[period] = store
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return store
+
+    def segments(self, start=None, end=None, member_number=None, provider_number=None,
+                 before_period=None):
+        """Return the periods whose ranges can hold matching records, oldest first"""
+        periods = []
+        for period in sorted(self.catalog):
+            if before_period is not None and period >= before_period:
+                break
+            entry = self.catalog[period]
+            if not entry["records"]:
+                continue
+            low, high = entry["dates"]
+            if (start is not None and high < start) or (end is not None and low > end):
+                continue
+            if member_number is not None and not (
+                    entry["members"][0] <= member_number <= entry["members"][1]):
+                continue
+            if provider_number is not None and not (
+                    entry["providers"][0] <= provider_number <= entry["providers"][1]):
+                continue
+            periods.append(period)
+        return periods
+
+    def records_between(self, start=None, end=None, member_number=None, provider_number=None,
+                        before_period=None):
+        """Yield archived records period by period, each period in service date order"""
+        for period in self.segments(start, end, member_number, provider_number, before_period):
+            yield from self.load(period).records_between(start, end, member_number,
+                                                         provider_number)
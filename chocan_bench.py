@@ -0,0 +1,241 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from chocan_system import ChocAnSystem
+
+FIRST_NAMES = ["Mary", "James", "Linda", "Robert", "Maria", "David", "Susan", "Wei",
+               "Fatima", "Carlos", "Anh", "Olga", "Kenji", "Aisha", "Liam", "Nora"]
+LAST_NAMES = ["Smith", "Johnson", "Nguyen", "Garcia", "Brown", "Kim", "Lopez",
+              "Patel", "Miller", "Davis", "Wilson", "Cohen", "Silva", "Tanaka"]
+CITIES = [("Portland", "OR", "972"), ("Salem", "OR", "973"), ("Eugene", "OR", "974"),
+          ("Seattle", "WA", "981"), ("Vancouver", "WA", "986"), ("Boise", "ID", "837")]
+
+class SyntheticData:
+    """
+    Reproducible members, providers and claims. Visits follow a Zipf-like
+    skew (a few members and providers account for most services), service
+    dates fall in the week before the anchor date and about 5% of members
+    are suspended.
+    """
+
+    def __init__(self, member_count, provider_count, seed=314, anchor=date(2024, 11, 8)):
+        self.rng = random.Random(seed)
+        self.member_numbers = [str(100000000 + i) for i in range(member_count)]
+        self.provider_numbers = [str(500000000 + i) for i in range(provider_count)]
+        self.member_weights = [1 / (rank + 1) ** 1.1 for rank in range(member_count)]
+        self.provider_weights = [1 / (rank + 1) ** 0.8 for rank in range(provider_count)]
+        self.rng.shuffle(self.member_weights)
+        self.rng.shuffle(self.provider_weights)
+        self.dates = [(anchor - timedelta(days=d)).strftime("%m-%d-%Y") for d in range(7)]
+
+    def _person(self, number):
+        city, state, zip_prefix = self.rng.choice(CITIES)
+        return (
+            f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}",
+            number,
+            f"{self.rng.randint(1, 9999)} {self.rng.choice(LAST_NAMES)} St",
+            city,
+            state,
+            zip_prefix + str(self.rng.randint(0, 99)).zfill(2),
+        )
+
+    def populate(self, system):
+        for number in self.member_numbers:
+            system.add_member(*self._person(number))
+            if self.rng.random() < 0.05:
+                system.update_member(number, status="suspended")
+        for number in self.provider_numbers:
+            system.add_provider(*self._person(number))
+
+    def claims(self, count, service_codes):
+        members = self.rng.choices(self.member_numbers, self.member_weights, k=count)
+        providers = self.rng.choices(self.provider_numbers, self.provider_weights, k=count)
+        return [
+            (
+                member_number,
+                provider_number,
+                self.rng.choice(self.dates),
+                self.rng.choice(service_codes),
+                "Follow-up" if self.rng.random() < 0.2 else "",
+            )
+            for member_number, provider_number in zip(members, providers)
+        ]
+
+    def lookups(self, count, invalid_fraction=0.1):
+        return [
+            str(900000000 + self.rng.randint(0, 99999999))
+            if self.rng.random() < invalid_fraction
+            else self.rng.choice(self.member_numbers)
+            for _ in range(count)
+        ]
+
+def _stats(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"calls": 0}
+
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1e6
+
+    total = sum(samples)
+    return {
+        "calls": len(samples),
+        "total_seconds": total,
+        "mean_us": total / len(samples) * 1e6,
+        "p50_us": percentile(0.50),
+        "p95_us": percentile(0.95),
+        "p99_us": percentile(0.99),
+        "max_us": samples[-1] * 1e6,
+    }
+
+def _time_calls(func, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return _stats(samples)
+
+def bench_batch_ingestion(data, system, claims):
+    """Compare the single-call claim path against process_services_batch"""
+    single = ChocAnSystem(duplicate_mode=None)
+    data.populate(single)
+    start = time.perf_counter()
+    for claim in claims:
+        single.process_service(*claim)
+    single_seconds = time.perf_counter() - start
+
+    stream = io.StringIO()
+    stream.write("member_number,provider_number,service_date,service_code,comments\n")
+    for claim in claims:
+        stream.write(",".join(claim) + "\n")
+    stream.seek(0)
+
+    start = time.perf_counter()
+    system.process_services_batch(stream, fmt="csv")
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "claims": len(claims),
+        "single_per_second": len(claims) / single_seconds,
+        "batch_per_second": len(claims) / batch_seconds,
+    }
+
+def run_suite(member_count=10000, provider_count=200, record_count=100000,
+              seed=314, workers=1, report_sample=200):
+    """Build a synthetic system, time every core operation and return the results"""
+    data = SyntheticData(member_count, provider_count, seed)
+    operations = {}
+
+    # Synthetic claims often repeat a (member, provider, code, date) key; with duplicate
+    # checks off every claim is recorded, so runs compare with ones from before the checks
+    system = ChocAnSystem(duplicate_mode=None)
+    start = time.perf_counter()
+    data.populate(system)
+    operations["populate"] = _stats([time.perf_counter() - start])
+
+    service_codes = list(system.services)
+    claims = data.claims(record_count, service_codes)
+    operations["process_service"] = _time_calls(system.process_service, claims)
+    operations["validate_member"] = _time_calls(
+        system.validate_member, [(number,) for number in data.lookups(10000)]
+    )
+
+    batch = bench_batch_ingestion(
+        SyntheticData(member_count, provider_count, seed),
+        system,
+        data.claims(min(record_count, 20000), service_codes)
+    )
+
+    # Reports write to the working directory, so run them in a scratch one
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            members = data.rng.sample(data.member_numbers, min(report_sample, member_count))
+            providers = data.rng.sample(data.provider_numbers, min(report_sample, provider_count))
+            operations["generate_member_report"] = _time_calls(
+                system.generate_member_report, [(number,) for number in members]
+            )
+            operations["generate_provider_report"] = _time_calls(
+                system.generate_provider_report, [(number,) for number in providers]
+            )
+            operations["generate_provider_directory"] = _time_calls(
+                system.generate_provider_directory, [()]
+            )
+            operations["generate_summary_report"] = _time_calls(system.generate_summary_report, [()])
+            operations["generate_eft_report"] = _time_calls(system.generate_eft_report, [()])
+            operations["generate_all_reports"] = _time_calls(
+                system.generate_all_reports, [(workers,)]
+            )
+        finally:
+            os.chdir(cwd)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "members": member_count,
+            "providers": provider_count,
+            "records": record_count,
+            "seed": seed,
+            "workers": workers,
+        },
+        "operations": operations,
+        "batch_ingestion": batch,
+    }
+
+def compare(results, baseline, threshold=0.10):
+    """Return (operation, baseline_us, current_us) for every mean that slowed by more than threshold"""
+    regressions = []
+    for name, current in results["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if not previous or not previous.get("calls") or not current.get("calls"):
+            continue
+        if current["mean_us"] > previous["mean_us"] * (1 + threshold):
+            regressions.append((name, previous["mean_us"], current["mean_us"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="ChocAn core benchmark suite")
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--providers", type=int, default=200)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=314)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = run_suite(args.members, args.providers, args.records, args.seed, args.workers)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, stats in results["operations"].items():
+        print(f"{name:30} {stats['calls']:8d} calls  mean {stats['mean_us']:12.1f} us  "
+              f"p99 {stats['p99_us']:12.1f} us")
+    batch = results["batch_ingestion"]
+    print(f"{'batch ingestion':30} single {batch['single_per_second']:.0f}/s  "
+          f"batch {batch['batch_per_second']:.0f}/s")
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.1f} us -> {after:.1f} us")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import mmap
+import os
+import struct
+
+# Report bundle: every report of one run in a single file
+#   header   magic
+#   reports  UTF-8 text, back to back
+#   table    one entry per report sorted by (kind, number), searched in place
+#   footer   table offset, entry count, magic
+BUNDLE_MAGIC = b"CHOCBDL1"
+FOOTER = struct.Struct("<QQ8s")
+ENTRY = struct.Struct("<c9sQQ")  # kind, number, offset, length
+KEY_SIZE = 10  # kind + number, the sort key at the start of each entry
+KINDS = {"member": b"M", "provider": b"P", "summary": b"S", "eft": b"E"}
+REPORTS = {kind: report for report, kind in KINDS.items()}
+NO_NUMBER = b" " * 9  # summary and EFT reports
+BUFFER_SIZE = 1 << 20
+
+def _key(report, number):
+    try:
+        kind = KINDS[report]
+    except KeyError:
+        raise ValueError(f"Unknown report kind: {report}") from None
+    if number is None:
+        return kind + NO_NUMBER
+    number = str(number).zfill(9).encode("ascii")
+    if len(number) != 9:
+        raise ValueError(f"Report number must have 9 digits: {number!r}")
+    return kind + number
+
+class BundleWriter:
+    """
+    Append reports to a bundle file through one large buffer, then write
+    the offset table on close. Adding a report twice keeps the last copy.
+    The bundle is built next to filename and replaces it only on close,
+    so readers never see a half-written one.
+    """
+
+    def __init__(self, filename, buffer_size=BUFFER_SIZE):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.temp_filename = filename + ".tmp"
+        self.file = open(self.temp_filename, "wb")
+        self.file.write(BUNDLE_MAGIC)
+        self.buffer = bytearray()
+        self.offset = len(BUNDLE_MAGIC)
+        self.entries = {}  # key: kind + number, value: (offset, length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, report, number, text):
+        """Add one rendered report; number is None for summary and EFT reports"""
+        self._add(_key(report, number), text.encode("utf-8"))
+
+    def _add(self, key, data):
+        self.entries[key] = (self.offset, len(data))
+        self.buffer += data
+        self.offset += len(data)
+        if len(self.buffer) >= self.buffer_size:
+            self._flush()
+
+    def carry_forward(self, members=None, providers=None):
+        """
+        Copy every report of the bundle being replaced that was not added
+        in this run, as an incremental run leaves unchanged report files
+        alone. Given the member and provider numbers that still exist,
+        reports of the others are dropped. Returns how many were copied.
+        """
+        if not os.path.exists(self.filename):
+            return 0
+        existing = {KINDS["member"]: members, KINDS["provider"]: providers}
+        copied = 0
+        with BundleReader(self.filename) as old:
+            for key, offset, length in old._entries():
+                if key in self.entries:
+                    continue
+                numbers = existing.get(key[:1])
+                if numbers is not None and key[1:].decode("ascii") not in numbers:
+                    continue
+                self._add(key, old.map[offset:offset + length])
+                copied += 1
+        return copied
+
+    def _flush(self):
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.file.closed:
+            return
+        table = self.offset
+        for key in sorted(self.entries):
+            offset, length = self.entries[key]
+            self.buffer += ENTRY.pack(key[:1], key[1:], offset, length)
+        self.buffer += FOOTER.pack(table, len(self.entries), BUNDLE_MAGIC)
+        self._flush()
+        self.file.close()
+        os.replace(self.temp_filename, self.filename)
+
+    def abort(self):
+        """Discard the bundle being built and leave any previous one in place"""
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.temp_filename)
+
+class BundleReader:
+    """
+    Read single reports out of a bundle through a memory map. Opening
+    reads only the footer; a lookup is a binary search over the table.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < len(BUNDLE_MAGIC) + FOOTER.size:
+            self.file.close()
+            raise ValueError(f"{filename} is not a report bundle")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.table, self.count, magic = FOOTER.unpack_from(self.map, size - FOOTER.size)
+        if self.map[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC or magic != BUNDLE_MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not a report bundle")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def _position(self, index):
+        return self.table + index * ENTRY.size
+
+    def _find(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = self._position(middle)
+            if self.map[position:position + KEY_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            position = self._position(low)
+            if self.map[position:position + KEY_SIZE] == key:
+                return ENTRY.unpack_from(self.map, position)[2:]
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, item):
+        return self._find(_key(*item)) is not None
+
+    def _entries(self):
+        # (key, offset, length) for every report, in key order
+        for index in range(self.count):
+            kind, number, offset, length = ENTRY.unpack_from(self.map, self._position(index))
+            yield kind + number, offset, length
+
+    def __iter__(self):
+        """Yield (report, number) for every report, number None for summary and EFT"""
+        for key, _, _ in self._entries():
+            number = key[1:]
+            yield REPORTS[key[:1]], None if number == NO_NUMBER else number.decode("ascii")
+
+    def read(self, report, number=None):
+        """Return one report's text; KeyError if the bundle does not hold it"""
+        found = self._find(_key(report, number))
+        if found is None:
+            raise KeyError((report, number))
+        offset, length = found
+        return self.map[offset:offset + length].decode("utf-8")
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import base64
+import hashlib
+import math
+import threading
+import time
+
+class BloomFilter:
+    """
+    Compact set of member numbers with no false negatives: a number the
+    filter does not contain was never added, so it is certainly invalid
+    """
+
+    def __init__(self, bits, hashes, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        return cls(bits, hashes)
+
+    @classmethod
+    def from_numbers(cls, numbers, error_rate=0.01, headroom=2):
+        """Build a filter sized for headroom times the current numbers"""
+        numbers = list(numbers)
+        bloom = cls.for_capacity(len(numbers) * headroom, error_rate)
+        for number in numbers:
+            bloom.add(number)
+        return bloom
+
+    def _positions(self, number):
+        # Double hashing from one 128-bit digest
+        digest = hashlib.blake2b(number.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.bits
+
+    def add(self, number):
+        for position in self._positions(number):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, number):
+        return all(self.data[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(number))
+
+    def to_dict(self):
+        return {
+            "bits": self.bits,
+            "hashes": self.hashes,
+            "data": base64.b64encode(self.data).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["bits"], state["hashes"], base64.b64decode(state["data"]))
+
+class ValidationCache:
+    """
+    Terminal-side cache of validate_member results. Answers are kept for
+    ttl seconds, at most capacity of them, evicting the least recently
+    used. Numbers missing from the member filter are rejected without
+    asking the data center. apply() takes pushed member changes.
+    """
+
+    def __init__(self, validate, capacity=4096, ttl=300.0, clock=time.monotonic):
+        self.validate_remote = validate
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key: member_number, value: (result, expires_at)
+        self.generations = {}  # key: member_number, value: changes taken by apply()
+        self.filter = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.filtered = 0
+        self.misses = 0
+
+    def load_filter(self, bloom):
+        with self.lock:
+            self.filter = bloom
+
+    def validate(self, member_number):
+        with self.lock:
+            entry = self.entries.get(member_number)
+            if entry is not None:
+                if entry[1] > self.clock():
+                    self.entries.move_to_end(member_number)
+                    self.hits += 1
+                    return entry[0]
+                del self.entries[member_number]
+            if self.filter is not None and member_number not in self.filter:
+                self.filtered += 1
+                return "Invalid Number"
+            self.misses += 1
+            generation = self.generations.get(member_number, 0)
+
+        # Ask the data center outside the lock so other swipes are not held up
+        result = self.validate_remote(member_number)
+        self._store(member_number, result, generation)
+        return result
+
+    def _store(self, member_number, result, generation=None):
+        with self.lock:
+            # A change pushed while the answer was being fetched is newer; keep it
+            if generation is not None and self.generations.get(member_number, 0) != generation:
+                return
+            self.entries[member_number] = (result, self.clock() + self.ttl)
+            self.entries.move_to_end(member_number)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def apply(self, member_number, result):
+        """Take a pushed change: result is what validate_member now returns"""
+        with self.lock:
+            self.generations[member_number] = self.generations.get(member_number, 0) + 1
+            if result != "Invalid Number" and self.filter is not None:
+                self.filter.add(member_number)
+        self._store(member_number, result)
+
+    def invalidate(self, member_number=None):
+        """Drop one cached answer, or all of them"""
+        with self.lock:
+            if member_number is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(member_number, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "filtered": self.filtered,
+                "misses": self.misses,
+            }
@@ -1,10 +1,23 @@
+import argparse
+import json
+import os
+import shlex
 import sys
 from datetime import datetime
+from chocan_cache import ValidationCache
+from chocan_bundle import KINDS, BundleReader
+from chocan_eft import verify_eft_batch
+from chocan_storage import SQLiteStorage
 from chocan_system import ChocAnSystem
 
 class ChocAnCLI:
-    def __init__(self):
-        self.system = ChocAnSystem()
+    def __init__(self, data_dir=None, report_workers=1):
+        self.system = ChocAnSystem(data_dir)
+        # Swipes are answered from the terminal's cache; member changes are pushed to it
+        self.validator = ValidationCache(self.system.validate_member)
+        self.system.subscribe(self.validator.apply)
+        self.validator.load_filter(self.system.member_filter())
+        self.report_workers = report_workers
         self.current_provider = None
 
     def provider_terminal(self):
@@ -48,7 +61,7 @@ class ChocAnCLI:
         member_number = input("Enter member number (or swipe card): ")
         
         # Validate member
-        validation_result = self.system.validate_member(member_number)
+        validation_result = self.validator.validate(member_number)
         print(f"\nMember Status: {validation_result}")
         
         if validation_result != "Validated":
@@ -59,8 +72,7 @@ class ChocAnCLI:
         
         # Display available services
         print("\nAvailable Services:")
-        for code, service in self.system.services.items():
-            print(f"{code}: {service.name} - ${service.fee:.2f}")
+        print(self.system.catalog_listing(), end="")
         
         service_code = input("\nEnter service code: ")
         
@@ -96,9 +108,10 @@ class ChocAnCLI:
             print("1. Generate Reports")
             print("2. Manage Members")
             print("3. Manage Providers")
-            print("4. Exit")
+            print("4. Manage Services")
+            print("5. Exit")
             
-            choice = input("\nEnter choice (1-4): ")
+            choice = input("\nEnter choice (1-5): ")
             
             if choice == "1":
                 self.manager_reports_menu()
@@ -107,6 +120,8 @@ class ChocAnCLI:
             elif choice == "3":
                 self.manage_providers()
             elif choice == "4":
+                self.manage_services()
+            elif choice == "5":
                 print("\nExiting manager terminal...")
                 break
             else:
@@ -121,19 +136,16 @@ class ChocAnCLI:
             print("3. Generate Provider Report")
             print("4. Generate Summary Report")
             print("5. Generate EFT Report")
-            print("6. Return to Main Menu")
+            print("6. Close Week")
+            print("7. Generate Changed Reports")
+            print("8. Return to Main Menu")
             
-            choice = input("\nEnter choice (1-6): ")
+            choice = input("\nEnter choice (1-8): ")
             
             if choice == "1":
                 # Generate all reports
-                for member_number in self.system.members:
-                    self.system.generate_member_report(member_number)
-                for provider_number in self.system.providers:
-                    self.system.generate_provider_report(provider_number)
-                self.system.generate_summary_report()
-                self.system.generate_eft_report()
-                print("\nAll reports have been generated.")
+                manifest = self.system.generate_all_reports(workers=self.report_workers)
+                print(f"\nAll reports have been generated ({len(manifest)} files).")
             
             elif choice == "2":
                 member_number = input("\nEnter member number: ")
@@ -160,6 +172,18 @@ class ChocAnCLI:
                 print("\nEFT report has been generated.")
             
             elif choice == "6":
+                closed = self.system.close_week()
+                print(f"\nWeek {closed['period']} closed with {closed['records']} services.")
+                print("Summary and EFT reports have been generated.")
+            
+            elif choice == "7":
+                # Only members and providers with changes since the last run
+                manifest = self.system.generate_all_reports(
+                    workers=self.report_workers, incremental=True
+                )
+                print(f"\nChanged reports have been generated ({len(manifest)} files).")
+            
+            elif choice == "8":
                 break
             
             else:
@@ -173,9 +197,10 @@ class ChocAnCLI:
             print("2. Delete Member")
             print("3. Update Member")
             print("4. View Member")
-            print("5. Return to Main Menu")
+            print("5. Search Members")
+            print("6. Return to Main Menu")
             
-            choice = input("\nEnter choice (1-5): ")
+            choice = input("\nEnter choice (1-6): ")
             
             if choice == "1":
                 name = input("Enter member name: ")
@@ -231,6 +256,17 @@ class ChocAnCLI:
                     print("\nMember not found.")
             
             elif choice == "5":
+                print("\nSearch by prefix (press Enter to skip a field):")
+                name = input("Name: ")
+                city = input("City: ")
+                zip_code = input("ZIP: ")
+                matches = self.system.search_members(name, city, zip_code)
+                if not matches:
+                    print("\nNo members found.")
+                for match in matches:
+                    print(f"{match.number}  {match.name:25}  {match.city}, {match.state} {match.zip_code}")
+            
+            elif choice == "6":
                 break
             
             else:
@@ -244,9 +280,10 @@ class ChocAnCLI:
             print("2. Delete Provider")
             print("3. Update Provider")
             print("4. View Provider")
-            print("5. Return to Main Menu")
+            print("5. Search Providers")
+            print("6. Return to Main Menu")
             
-            choice = input("\nEnter choice (1-5): ")
+            choice = input("\nEnter choice (1-6): ")
             
             if choice == "1":
                 name = input("Enter provider name: ")
@@ -303,13 +340,257 @@ class ChocAnCLI:
                     print("\nProvider not found.")
             
             elif choice == "5":
+                print("\nSearch by prefix (press Enter to skip a field):")
+                name = input("Name: ")
+                city = input("City: ")
+                zip_code = input("ZIP: ")
+                matches = self.system.search_providers(name, city, zip_code)
+                if not matches:
+                    print("\nNo providers found.")
+                for match in matches:
+                    print(f"{match.number}  {match.name:25}  {match.city}, {match.state} {match.zip_code}")
+            
+            elif choice == "6":
                 break
             
             else:
                 print("\nInvalid choice. Please try again.")
 
-def main():
-    cli = ChocAnCLI()
+    def manage_services(self):
+        """Handle service catalog operations"""
+        while True:
+            print(f"\nService Catalog Menu (version {self.system.catalog_version}):")
+            print("1. Add Service")
+            print("2. Delete Service")
+            print("3. Update Service")
+            print("4. View Catalog")
+            print("5. Return to Main Menu")
+            
+            choice = input("\nEnter choice (1-5): ")
+            
+            if choice == "1":
+                code = input("Enter service code (6 digits): ")
+                name = input("Enter service name: ")
+                try:
+                    fee = float(input("Enter fee: "))
+                except ValueError:
+                    print("\nError: Invalid fee")
+                    continue
+                result = self.system.add_service(code, name, fee)
+                print(f"\n{result}")
+            
+            elif choice == "2":
+                code = input("Enter service code: ")
+                result = self.system.delete_service(code)
+                print(f"\n{result}")
+            
+            elif choice == "3":
+                code = input("Enter service code: ")
+                if code in self.system.services:
+                    print("\nEnter new information (press Enter to keep current value):")
+                    service = self.system.services[code]
+                    
+                    name = input(f"Name [{service.name}]: ") or service.name
+                    fee = input(f"Fee [{service.fee:.2f}]: ")
+                    try:
+                        fee = float(fee) if fee else service.fee
+                    except ValueError:
+                        print("\nError: Invalid fee")
+                        continue
+                    
+                    result = self.system.update_service(code, name=name, fee=fee)
+                    print(f"\n{result}")
+                else:
+                    print("\nService not found.")
+            
+            elif choice == "4":
+                print()
+                print(self.system.catalog_listing(), end="")
+            
+            elif choice == "5":
+                break
+            
+            else:
+                print("\nInvalid choice. Please try again.")
+
+# Scripted mode: command name -> (ChocAnSystem method, positional arguments)
+COMMANDS = {
+    "add-member": ("add_member", ("name", "number", "street", "city", "state", "zip_code")),
+    "add-provider": ("add_provider", ("name", "number", "street", "city", "state", "zip_code")),
+    "delete-member": ("delete_member", ("member_number",)),
+    "delete-provider": ("delete_provider", ("provider_number",)),
+    "update-member": ("update_member", ("member_number",)),
+    "update-provider": ("update_provider", ("provider_number",)),
+    "validate": ("validate_member", ("member_number",)),
+    "process-service": ("process_service",
+                        ("member_number", "provider_number", "service_date", "service_code")),
+    "add-service": ("add_service", ("code", "name", "fee")),
+    "update-service": ("update_service", ("code",)),
+    "delete-service": ("delete_service", ("code",)),
+    "close-week": ("close_week", ()),
+    "generate-reports": ("generate_all_reports", ()),
+    "provider-directory": ("generate_provider_directory", ()),
+    "eft-batch": ("generate_eft_batch", ()),
+}
+
+class ScriptError(Exception):
+    pass
+
+class _CommandParser(argparse.ArgumentParser):
+    """Raise instead of exiting, so one bad script line does not end the run"""
+
+    def error(self, message):
+        raise ScriptError(message)
+
+def build_command_parser(parser_class=_CommandParser):
+    parser = parser_class(prog="chocan", add_help=False)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, (_, names) in COMMANDS.items():
+        sub = subparsers.add_parser(command)
+        for name in names:
+            sub.add_argument(name)
+        if command.startswith("update-"):
+            sub.add_argument("fields", nargs="*", metavar="FIELD=VALUE")
+        elif command == "process-service":
+            sub.add_argument("--comments", default="")
+        elif command == "generate-reports":
+            sub.add_argument("--incremental", action="store_true")
+            sub.add_argument("--bundle", metavar="PATH",
+                             help="write every report into one bundle file")
+    batch = subparsers.add_parser("process-batch", help="record a CSV or JSONL file of claims")
+    batch.add_argument("path")
+    batch.add_argument("--format", choices=("csv", "jsonl"))
+    verify = subparsers.add_parser("verify-eft", help="check an EFT batch file's control totals")
+    verify.add_argument("path")
+    show = subparsers.add_parser("show-report", help="print one report from a bundle file")
+    show.add_argument("path")
+    show.add_argument("report", choices=tuple(KINDS))
+    show.add_argument("number", nargs="?")
+    script = subparsers.add_parser("run", help="run a script or JSONL file of commands")
+    script.add_argument("path")
+    return parser
+
+def _format_result(result):
+    if isinstance(result, list):
+        return f"{len(result)} reports written"
+    if isinstance(result, dict):
+        return f"Week {result['period']} closed with {result['records']} services"
+    return str(result)
+
+def run_command(system, command, fields, workers=1):
+    """Run one command given its name and keyword fields; return its output line"""
+    if command == "process-batch":
+        path = fields["path"]
+        fmt = fields.get("format") or ("jsonl" if path.endswith(".jsonl") else "csv")
+        with open(path, newline="") as f:
+            results = system.process_services_batch(f, fmt)
+        recorded = sum(1 for _, result in results if result.startswith("Service recorded"))
+        lines = [f"{recorded} of {len(results)} claims recorded"]
+        lines.extend(f"  row {row}: {result}" for row, result in results
+                     if not result.startswith("Service recorded"))
+        return "\n".join(lines)
+    if command == "verify-eft":
+        result = verify_eft_batch(fields["path"])
+        if not result["valid"]:
+            return f"invalid: {result['error']}"
+        return (f"valid: {result['records']} records, hash total {result['hash_total']}, "
+                f"${result['amount_cents'] / 100:.2f}")
+    if command == "show-report":
+        with BundleReader(fields["path"]) as bundle:
+            try:
+                return bundle.read(fields["report"], fields.get("number")).rstrip("\n")
+            except KeyError:
+                raise ScriptError(f"report not found in {fields['path']}") from None
+    if command not in COMMANDS:
+        raise ScriptError(f"unknown command: {command}")
+
+    method = getattr(system, COMMANDS[command][0])
+    if command == "generate-reports":
+        fields = {"workers": workers, **fields}
+    return _format_result(method(**fields))
+
+def _namespace_fields(args):
+    fields = {key: value for key, value in vars(args).items()
+              if key not in ("command", "fields") and value is not None}
+    for pair in getattr(args, "fields", None) or ():
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise ScriptError(f"expected FIELD=VALUE, got {pair!r}")
+        fields[key] = value
+    return fields
+
+def run_script(system, path, workers=1):
+    """
+    Run every command in a script file against one loaded system. Lines are
+    either JSON objects ({"op": "add-member", "name": ...}) or the same
+    words as the command line (add-member "Jane Doe" 123456789 ...).
+    Returns (output lines, error count).
+    """
+    parser = build_command_parser()
+    output = []
+    errors = 0
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                if line.startswith("{"):
+                    fields = json.loads(line)
+                    command = fields.pop("op")
+                else:
+                    args = parser.parse_args(shlex.split(line))
+                    command = args.command
+                    fields = _namespace_fields(args)
+                if command == "run":
+                    raise ScriptError("scripts cannot run other scripts")
+                result = run_command(system, command, fields, workers)
+            except (ScriptError, ValueError, KeyError, TypeError, OSError) as e:
+                errors += 1
+                result = f"error: {e}"
+            output.append(f"{line_number}: {result}")
+    return output, errors
+
+def run_scripted(argv):
+    """Non-interactive mode: one command from the command line, or a script of them"""
+    parser = build_command_parser(argparse.ArgumentParser)
+    parser.description = "ChocAn data processing, scripted mode"
+    parser.add_argument("--data-dir", default="chocan_data")
+    parser.add_argument("--sqlite", metavar="PATH", help="use an SQLite database instead")
+    parser.add_argument("--registry", action="store_true")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="report worker processes")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        system = ChocAnSystem(storage=SQLiteStorage(args.sqlite))
+    else:
+        system = ChocAnSystem(args.data_dir, registry=args.registry)
+    try:
+        if args.command == "run":
+            output, errors = run_script(system, args.path, args.workers)
+        else:
+            fields = _namespace_fields(args)
+            for option in ("data_dir", "sqlite", "registry", "workers"):
+                fields.pop(option, None)
+            try:
+                output, errors = [run_command(system, args.command, fields, args.workers)], 0
+            except (ScriptError, ValueError, KeyError, TypeError, OSError) as e:
+                output, errors = [f"error: {e}"], 1
+    finally:
+        system.close()
+
+    # One buffered write for the whole run
+    sys.stdout.write("\n".join(output) + "\n")
+    return 1 if errors else 0
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        sys.exit(run_scripted(argv))
+
+    cli = ChocAnCLI(data_dir="chocan_data", report_workers=os.cpu_count() or 1)
     
     while True:
         print("\nChocAn Terminal System")
@@ -325,6 +606,7 @@ def main():
             cli.manager_terminal()
         elif choice == "3":
             print("\nExiting ChocAn system...")
+            cli.system.close()
             break
         else:
             print("\nInvalid choice. Please try again.")
@@ -0,0 +1,61 @@
+from collections import deque
+import threading
+
+class DuplicateIndex:
+    """
+    Hashes of recently entered claims (member, provider, service code,
+    service date), remembered for window seconds of entry time. Lookups
+    and inserts are O(1); entries older than the window are evicted as
+    new claims arrive, so memory holds one window of claims at most.
+    """
+
+    def __init__(self, window=7 * 86400):
+        self.window = window
+        self.entered = {}  # key: claim hash, value: latest entered_at
+        self.order = deque()  # (entered_at, claim hash) in arrival order
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def claim_key(member_number, provider_number, service_code, service_date):
+        return hash((member_number, provider_number, service_code, service_date))
+
+    def _evict(self, now):
+        cutoff = now - self.window
+        order = self.order
+        while order and order[0][0] < cutoff:
+            entered_at, key = order.popleft()
+            # A repeat may have refreshed the key since; only drop the latest entry
+            if self.entered.get(key) == entered_at:
+                del self.entered[key]
+
+    def _add(self, key, entered_at):
+        self.entered[key] = entered_at
+        self.order.append((entered_at, key))
+
+    def add(self, key, entered_at):
+        """Remember a recorded claim"""
+        with self.lock:
+            self._add(key, entered_at)
+            self._evict(entered_at)
+
+    def check(self, key, entered_at):
+        """
+        Return True if the claim repeats one inside the window; otherwise
+        reserve it so a concurrent copy is caught too
+        """
+        with self.lock:
+            self._evict(entered_at)
+            if key in self.entered:
+                return True
+            self._add(key, entered_at)
+            return False
+
+    def release(self, keys, entered_at):
+        """Drop reservations made at entered_at for claims that were never recorded"""
+        with self.lock:
+            for key in keys:
+                if self.entered.get(key) == entered_at:
+                    del self.entered[key]
+
+    def __len__(self):
+        return len(self.entered)
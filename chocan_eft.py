@@ -0,0 +1,123 @@
+from datetime import datetime
+
+# Fixed-width EFT batch file for the bank's loader, 80 characters plus a newline per record:
+#   H  file date YYYYMMDD, time HHMMSS, period, originator name
+#   D  sequence, provider number, provider name, amount in cents, consultations
+#   T  detail count, hash total (sum of provider numbers), total amount in cents
+RECORD_WIDTH = 80
+ORIGINATOR = "CHOCOHOLICS ANONYMOUS"
+HASH_MODULUS = 10 ** 18  # the hash total keeps its low 18 digits
+
+def valid_provider_number(number):
+    # Detail records hold 9 digits, and the hash total sums them
+    return len(number) == 9 and number.isascii() and number.isdigit()
+
+def check_payments(payments):
+    """Raise ValueError naming the first payment a batch file cannot carry"""
+    for number, name, consultations, cents in payments:
+        if cents > 0 and not valid_provider_number(number):
+            raise ValueError(f"Provider {name} has number {number!r}, not 9 digits; "
+                             "fix it before writing the EFT batch")
+
+def _pad(record):
+    if len(record) > RECORD_WIDTH:
+        raise ValueError(f"EFT record longer than {RECORD_WIDTH} characters")
+    return record.ljust(RECORD_WIDTH) + "\n"
+
+def _text(value, width):
+    # Fixed-width fields are plain ASCII
+    return value.encode("ascii", errors="replace").decode("ascii")[:width].ljust(width)
+
+def header_record(created, period):
+    return _pad(f"H{created:%Y%m%d}{created:%H%M%S}{period:06d}{_text(ORIGINATOR, 23)}")
+
+def detail_record(sequence, number, name, cents, consultations):
+    return _pad(f"D{sequence:09d}{number:>09}{_text(name, 25)}{cents:012d}{consultations:06d}")
+
+def trailer_record(count, hash_total, total_cents):
+    return _pad(f"T{count:09d}{hash_total % HASH_MODULUS:018d}{total_cents:015d}")
+
+def write_eft_batch(filename, payments, period, created=None, chunk_size=1000):
+    """
+    Stream payments ((provider number, name, consultations, amount in
+    cents) tuples) into a batch file, chunk_size records per write.
+    Payments of nothing are skipped. Returns the control totals.
+    """
+    if created is None:
+        created = datetime.now()
+    count = 0
+    hash_total = 0
+    total_cents = 0
+    with open(filename, "w", encoding="ascii", newline="\n") as f:
+        f.write(header_record(created, period))
+        chunk = []
+        for number, name, consultations, cents in payments:
+            if cents <= 0:
+                continue
+            count += 1
+            hash_total += int(number)
+            total_cents += cents
+            chunk.append(detail_record(count, number, name, cents, consultations))
+            if len(chunk) >= chunk_size:
+                f.write("".join(chunk))
+                chunk = []
+        f.write("".join(chunk))
+        f.write(trailer_record(count, hash_total, total_cents))
+    return {"records": count, "hash_total": hash_total % HASH_MODULUS,
+            "amount_cents": total_cents}
+
+def verify_eft_batch(filename):
+    """
+    Check a batch file one record at a time: layout, detail sequence and
+    the trailer's control totals. Returns the totals with "valid" and, for
+    a bad file, the first "error" found.
+    """
+    result = {"valid": False, "error": None, "records": 0, "hash_total": 0, "amount_cents": 0}
+    count = 0
+    hash_total = 0
+    total_cents = 0
+    trailer = None
+    with open(filename, encoding="ascii", newline="\n") as f:
+        for line_number, line in enumerate(f, start=1):
+            if len(line) != RECORD_WIDTH + 1 or not line.endswith("\n"):
+                result["error"] = f"record {line_number}: wrong length"
+                return result
+            kind = line[0]
+            if line_number == 1:
+                if kind != "H":
+                    result["error"] = "record 1: missing header"
+                    return result
+            elif trailer is not None:
+                result["error"] = f"record {line_number}: data after trailer"
+                return result
+            elif kind == "D":
+                count += 1
+                try:
+                    sequence = int(line[1:10])
+                    number = int(line[10:19])
+                    cents = int(line[44:56])
+                except ValueError:
+                    result["error"] = f"record {line_number}: bad numeric field"
+                    return result
+                if sequence != count:
+                    result["error"] = f"record {line_number}: sequence {sequence}, expected {count}"
+                    return result
+                hash_total += number
+                total_cents += cents
+            elif kind == "T":
+                trailer = line
+            else:
+                result["error"] = f"record {line_number}: unknown record type {kind!r}"
+                return result
+
+    if trailer is None:
+        result["error"] = "missing trailer"
+        return result
+    hash_total %= HASH_MODULUS
+    result.update(records=count, hash_total=hash_total, amount_cents=total_cents)
+    if (int(trailer[1:10]), int(trailer[10:28]), int(trailer[28:43])) != (
+            count, hash_total, total_cents):
+        result["error"] = "trailer control totals do not match the detail records"
+        return result
+    result["valid"] = True
+    return result
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+
+class Journal:
+    """
+    Append-only write-ahead journal with group commit: an append returns
+    only once its entry is on disk, and one fsync covers every entry
+    written while the previous one ran
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seq = 0  # last entry written
+        self.synced_seq = 0  # last entry known to be on disk
+        self.syncing = False  # an fsync is running outside the lock
+        self.file = None
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self):
+        # Segment files are named after the first sequence number they hold
+        names = [
+            name for name in os.listdir(self.directory)
+            if name.startswith("journal_") and name.endswith(".log")
+        ]
+        return sorted(names)
+
+    def replay(self, after_seq=0):
+        """Yield (seq, op, args) for every entry newer than after_seq"""
+        for name in self._segments():
+            with open(os.path.join(self.directory, name)) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn write at the tail of a segment
+                    self.seq = max(self.seq, entry["seq"])
+                    if entry["seq"] > after_seq:
+                        yield entry["seq"], entry["op"], entry["args"]
+
+    def open(self, after_seq=0):
+        """Open a fresh segment for appends following after_seq"""
+        self.seq = max(self.seq, after_seq)
+        self.synced_seq = self.seq
+        filename = os.path.join(self.directory, f"journal_{self.seq + 1:012d}.log")
+        self.file = open(filename, "a")
+
+    def append(self, op, args):
+        """Write one entry and wait until it is durable; returns its sequence number"""
+        seq = self.write(op, args)
+        self.wait(seq)
+        return seq
+
+    def write(self, op, args):
+        """Write one entry without waiting for it to reach the disk (see wait)"""
+        with self.lock:
+            self.seq += 1
+            self.file.write(json.dumps({"seq": self.seq, "op": op, "args": args}) + "\n")
+            return self.seq
+
+    def wait(self, seq):
+        """Block until every entry up to seq is on disk"""
+        with self.lock:
+            self._sync(seq)
+
+    def sync(self):
+        """Flush and fsync every entry written so far"""
+        with self.lock:
+            self._sync(self.seq)
+
+    def _sync(self, seq):
+        # Called with the lock held. The fsync itself runs without it, so other
+        # threads keep writing entries; the next fsync commits them as one group.
+        while self.synced_seq < seq:
+            if self.syncing:
+                self.synced.wait()
+                continue
+            group = self.seq
+            self.file.flush()
+            fileno = self.file.fileno()
+            self.syncing = True
+            self.lock.release()
+            try:
+                os.fsync(fileno)
+            finally:
+                self.lock.acquire()
+                self.syncing = False
+                self.synced.notify_all()
+            self.synced_seq = group
+
+    def _settle(self):
+        # Before the file is closed: everything written is on disk and no fsync is running
+        while self.syncing or self.synced_seq < self.seq:
+            if self.syncing:
+                self.synced.wait()
+            else:
+                self._sync(self.seq)
+
+    def roll(self):
+        """Start a new segment after the last entry written; returns that entry's seq"""
+        with self.lock:
+            self._settle()
+            self.file.close()
+            self.open(self.seq)
+            return self.seq
+
+    def prune(self, snapshot_seq):
+        """Drop the segments a snapshot at snapshot_seq covers, once it is saved"""
+        with self.lock:
+            # Segments are named after their first entry and roll() ended one at snapshot_seq
+            covered = [name for name in self._segments()
+                       if int(name[len("journal_"):-len(".log")]) <= snapshot_seq]
+        for name in covered:
+            os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._settle()
+                self.file.close()
+                self.file = None
+
+class SnapshotStore:
+    """Compact point-in-time snapshots of the full system state"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _snapshots(self):
+        names = [
+            name for name in os.listdir(self.directory)
+            if name.startswith("snapshot_") and name.endswith(".json")
+        ]
+        return sorted(names)
+
+    def save(self, seq, state):
+        filename = os.path.join(self.directory, f"snapshot_{seq:012d}.json")
+        temp_filename = filename + ".tmp"
+
+        with open(temp_filename, "w") as f:
+            json.dump({"seq": seq, "state": state}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+
+        # Only the newest snapshot is needed for recovery
+        for name in self._snapshots():
+            if os.path.join(self.directory, name) != filename:
+                os.remove(os.path.join(self.directory, name))
+
+    def load_latest(self):
+        """Return (seq, state) of the newest snapshot, or (0, None)"""
+        snapshots = self._snapshots()
+        if not snapshots:
+            return 0, None
+        with open(os.path.join(self.directory, snapshots[-1])) as f:
+            snapshot = json.load(f)
+        return snapshot["seq"], snapshot["state"]
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+class Histogram:
+    """Latency histogram with power-of-two microsecond buckets"""
+    BUCKETS = 32  # bucket i holds latencies below 2**i microseconds
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound, in microseconds, of the bucket holding the given fraction"""
+        target = self.count * fraction
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                return float(2 ** i)
+        return 0.0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "max_us": self.max * 1e6,
+            "p50_us": self.percentile(0.50),
+            "p95_us": self.percentile(0.95),
+            "p99_us": self.percentile(0.99),
+            "buckets": {f"<{2 ** i}us": n for i, n in enumerate(self.buckets) if n},
+        }
+
+class Metrics:
+    """Per-operation call counts, latency histograms and report output totals"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {"report_files": 0, "report_bytes": 0}
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count_reports(self, result):
+        # A filename, a list of filenames, or a manifest of entries. Bundled
+        # reports share one file, which is counted once.
+        if isinstance(result, str):
+            result = [result]
+        filenames = list(dict.fromkeys(
+            entry if isinstance(entry, str) else entry["filename"] for entry in result))
+
+        written = 0
+        for filename in filenames:
+            try:
+                written += os.path.getsize(filename)
+            except OSError:
+                pass
+        with self.lock:
+            self.counters["report_files"] += len(filenames)
+            self.counters["report_bytes"] += written
+
+    def instrument(self, name, func):
+        """Wrap a bound method so every call is timed under name"""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start)
+            return result
+        return timed
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of every counter and histogram"""
+        with self.lock:
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "counters": dict(self.counters),
+                "operations": {
+                    name: histogram.snapshot()
+                    for name, histogram in self.histograms.items()
+                },
+            }
@@ -0,0 +1,319 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from chocan_aggregate import Columns
+
+def parse_date(text):
+    """Convert an MM-DD-YYYY string to a date ordinal"""
+    month, day, year = text.split("-")
+    return date(int(year), int(month), int(day)).toordinal()
+
+def format_date(ordinal):
+    return date.fromordinal(ordinal).strftime("%m-%d-%Y")
+
+def parse_datetime(text):
+    """Convert an MM-DD-YYYY HH:MM:SS string to seconds since day 1"""
+    day, clock = text.split(" ")
+    hours, minutes, seconds = clock.split(":")
+    return parse_date(day) * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def format_datetime(timestamp):
+    ordinal, seconds = divmod(timestamp, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{format_date(ordinal)} {hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def datetime_to_timestamp(moment):
+    return (moment.toordinal() * 86400 + moment.hour * 3600
+            + moment.minute * 60 + moment.second)
+
+class ServiceRecord:
+    __slots__ = ("current_datetime", "service_date", "provider_number",
+                 "member_number", "service_code", "comments", "fee_cents")
+
+    def __init__(self, current_datetime, service_date, provider_number,
+                 member_number, service_code, comments="", fee_cents=-1):
+        self.current_datetime = current_datetime
+        self.service_date = service_date
+        self.provider_number = provider_number
+        self.member_number = member_number
+        self.service_code = service_code
+        self.comments = comments[:100]  # Limit comments to 100 characters
+        self.fee_cents = fee_cents  # fee charged when recorded, -1 if unknown
+
+class Interner:
+    """Map strings to dense integer IDs and back"""
+    __slots__ = ("ids", "values")
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.ids = {value: i for i, value in enumerate(self.values)}
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+class RecordStore:
+    """
+    Column-oriented service records: interned IDs, integer dates and a
+    side table for the (usually empty) comments. ServiceRecord objects
+    are only built when a row is read. Rows are also indexed by member
+    and by provider, sorted by service date, and all rows by service
+    date for range queries.
+    """
+
+    def __init__(self):
+        self.member_numbers = Interner()
+        self.provider_numbers = Interner()
+        self.service_codes = Interner()
+        self.member_ids = array("l")
+        self.provider_ids = array("l")
+        self.service_ids = array("l")
+        self.service_dates = array("l")  # date ordinals
+        self.entered_at = array("q")  # seconds since day 1
+        self.fee_cents = array("q")  # fee charged when recorded, -1 if unknown
+        self.comments = {}  # key: row, value: comment text
+        self.member_index = {}  # key: member_number, value: rows sorted by service date
+        self.provider_index = {}  # key: provider_number, value: rows sorted by service date
+        self.date_order = (array("l"), 0)  # (rows sorted by service date, rows covered)
+
+    def append(self, entered_at, service_date, provider_number, member_number,
+               service_code, comments="", fee_cents=-1):
+        row = len(self.member_ids)
+        if comments:
+            self.comments[row] = comments[:100]
+        # member_ids goes last, so len(self) never counts a half-written row
+        self.provider_ids.append(self.provider_numbers.intern(provider_number))
+        self.service_ids.append(self.service_codes.intern(service_code))
+        self.service_dates.append(service_date)
+        self.entered_at.append(entered_at)
+        self.fee_cents.append(fee_cents)
+        self.member_ids.append(self.member_numbers.intern(member_number))
+        self._index_row(row)
+        return row
+
+    def _index_row(self, row):
+        dates = self.service_dates
+        for index, number in (
+            (self.member_index, self.member_numbers.values[self.member_ids[row]]),
+            (self.provider_index, self.provider_numbers.values[self.provider_ids[row]]),
+        ):
+            rows = index.get(number)
+            if rows is None:
+                rows = index[number] = array("l")
+            rows.insert(bisect_right(rows, dates[row], key=lambda r: dates[r]), row)
+
+    def _date_order(self, limit=None):
+        # New rows are merged into the date order when it is next read, not on every
+        # append. The order is replaced as one (rows, count) pair and never changed in
+        # place, so a reader holding an older order can keep using it.
+        if limit is None:
+            limit = len(self)
+        rows, indexed = self.date_order
+        if indexed < limit:
+            dates = self.service_dates
+            merged = rows.tolist()
+            merged.extend(sorted(range(indexed, limit), key=dates.__getitem__))
+            merged.sort(key=dates.__getitem__)  # stable: rows of one date stay in entry order
+            rows = array("l", merged)
+            self.date_order = (rows, limit)
+        elif indexed > limit:
+            rows = array("l", (row for row in rows if row < limit))
+        return rows
+
+    def rows_between(self, start=None, end=None, rows=None):
+        """
+        Return the rows with start <= service date <= end (date ordinals,
+        None for open-ended), from rows sorted by date or from all rows
+        """
+        if rows is None:
+            rows = self._date_order()
+        dates = self.service_dates
+        low = 0 if start is None else bisect_left(rows, start, key=dates.__getitem__)
+        high = len(rows) if end is None else bisect_right(rows, end, key=dates.__getitem__)
+        return rows[low:high]
+
+    def _select(self, member_number=None, provider_number=None, limit=None):
+        # Rows sorted by service date for one member and/or provider, or all of them;
+        # with a limit, only rows below it
+        if member_number is not None:
+            rows = self.member_index.get(member_number, ())
+        elif provider_number is not None:
+            rows = self.provider_index.get(provider_number, ())
+        else:
+            return self._date_order(limit)
+        if limit is not None:
+            # Appends insert into the index lists, so read a copy
+            rows = [row for row in rows[:] if row < limit]
+        if member_number is not None and provider_number is not None:
+            provider_id = self.provider_numbers.ids.get(provider_number)
+            rows = [row for row in rows if self.provider_ids[row] == provider_id]
+        return rows
+
+    def records_between(self, start=None, end=None, member_number=None, provider_number=None):
+        """Yield records in service date order, optionally for one member or provider"""
+        return self.records(self.rows_between(start, end,
+                                              self._select(member_number, provider_number)))
+
+    def snapshot(self):
+        """Return a read-only view of the records stored so far"""
+        return RecordView(self, len(self))
+
+    def member_records(self, member_number):
+        """Yield a member's records in service date order"""
+        return self.records(self.member_index.get(member_number, ()))
+
+    def provider_records(self, provider_number):
+        """Yield a provider's records in service date order"""
+        return self.records(self.provider_index.get(provider_number, ()))
+
+    def drop_member(self, member_number):
+        self.member_index.pop(member_number, None)
+
+    def claims(self, since):
+        """Yield (entered_at, member, provider, service code, service date) entered since"""
+        members = self.member_numbers.values
+        providers = self.provider_numbers.values
+        codes = self.service_codes.values
+        for row, entered_at in enumerate(self.entered_at):
+            if entered_at >= since:
+                yield (entered_at, members[self.member_ids[row]],
+                       providers[self.provider_ids[row]], codes[self.service_ids[row]],
+                       self.service_dates[row])
+
+    def columns(self):
+        """Return the raw columns the aggregation engine reduces over"""
+        return Columns(self.provider_numbers.values, self.service_codes.values,
+                       self.provider_ids, self.service_ids, self.service_dates,
+                       self.fee_cents)
+
+    def member_numbers_seen(self):
+        """Return the members with records in this store"""
+        return self.member_numbers.values
+
+    def __len__(self):
+        return len(self.member_ids)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        return ServiceRecord(
+            format_datetime(self.entered_at[row]),
+            format_date(self.service_dates[row]),
+            self.provider_numbers.values[self.provider_ids[row]],
+            self.member_numbers.values[self.member_ids[row]],
+            self.service_codes.values[self.service_ids[row]],
+            self.comments.get(row, ""),
+            self.fee_cents[row]
+        )
+
+    def __iter__(self):
+        return self.records(range(len(self)))
+
+    def records(self, rows):
+        """Yield a ServiceRecord view for each row number"""
+        for row in rows:
+            yield self[row]
+
+    def to_state(self):
+        return {
+            "member_numbers": self.member_numbers.values,
+            "provider_numbers": self.provider_numbers.values,
+            "service_codes": self.service_codes.values,
+            "member_ids": self.member_ids.tolist(),
+            "provider_ids": self.provider_ids.tolist(),
+            "service_ids": self.service_ids.tolist(),
+            "service_dates": self.service_dates.tolist(),
+            "entered_at": self.entered_at.tolist(),
+            "fee_cents": self.fee_cents.tolist(),
+            "comments": [[row, text] for row, text in self.comments.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        store = cls()
+        store.member_numbers = Interner(state["member_numbers"])
+        store.provider_numbers = Interner(state["provider_numbers"])
+        store.service_codes = Interner(state["service_codes"])
+        store.member_ids = array("l", state["member_ids"])
+        store.provider_ids = array("l", state["provider_ids"])
+        store.service_ids = array("l", state["service_ids"])
+        store.service_dates = array("l", state["service_dates"])
+        store.entered_at = array("q", state["entered_at"])
+        # Older states carry no fees; -1 makes aggregation fall back to the catalog
+        store.fee_cents = array("q", state.get("fee_cents") or [-1] * len(store.entered_at))
+        store.comments = {row: text for row, text in state["comments"]}
+        for row in range(len(store)):
+            store._index_row(row)
+        return store
+
+class RecordView:
+    """
+    The rows of a RecordStore that existed when the view was taken. Rows
+    are only ever appended, so the view is just the store and a row count:
+    later rows are skipped and index lists are copied before reading.
+    Pickling a view ships a RecordStore holding only its rows.
+    """
+
+    def __init__(self, store, limit):
+        self.store = store
+        self.limit = limit
+
+    def __reduce__(self):
+        return RecordStore.from_state, (self.to_state(),)
+
+    def __len__(self):
+        return self.limit
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.limit
+        if not 0 <= row < self.limit:
+            raise IndexError(row)
+        return self.store[row]
+
+    def __iter__(self):
+        return self.store.records(range(self.limit))
+
+    def records(self, rows):
+        return self.store.records(rows)
+
+    def records_between(self, start=None, end=None, member_number=None, provider_number=None):
+        """Yield the view's records in service date order, optionally for one member or provider"""
+        store = self.store
+        return store.records(store.rows_between(
+            start, end, store._select(member_number, provider_number, self.limit)
+        ))
+
+    def member_records(self, member_number):
+        return self.records_between(member_number=member_number)
+
+    def provider_records(self, provider_number):
+        return self.records_between(provider_number=provider_number)
+
+    def columns(self):
+        store = self.store
+        limit = self.limit
+        return Columns(store.provider_numbers.values, store.service_codes.values,
+                       store.provider_ids[:limit], store.service_ids[:limit],
+                       store.service_dates[:limit], store.fee_cents[:limit])
+
+    def to_state(self):
+        store = self.store
+        limit = self.limit
+        comments = dict(store.comments)  # copied in one step while appends go on
+        return {
+            "member_numbers": list(store.member_numbers.values),
+            "provider_numbers": list(store.provider_numbers.values),
+            "service_codes": list(store.service_codes.values),
+            "member_ids": store.member_ids[:limit].tolist(),
+            "provider_ids": store.provider_ids[:limit].tolist(),
+            "service_ids": store.service_ids[:limit].tolist(),
+            "service_dates": store.service_dates[:limit].tolist(),
+            "entered_at": store.entered_at[:limit].tolist(),
+            "fee_cents": store.fee_cents[:limit].tolist(),
+            "comments": [[row, text] for row, text in comments.items() if row < limit],
+        }
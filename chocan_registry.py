@@ -0,0 +1,269 @@
+from collections.abc import MutableMapping
+import mmap
+import os
+import struct
+
+# Field widths fixed by the design document
+FIELDS = (("number", 9), ("name", 25), ("street", 25), ("city", 14),
+          ("state", 2), ("zip_code", 5))
+RECORD_SIZE = 1 + sum(width for _, width in FIELDS) + 1  # status flag + fields + newline
+
+ACTIVE = b"A"
+SUSPENDED = b"S"
+DELETED = b"D"  # tombstone; the slot is reused if the number is added again
+
+HEADER = struct.Struct("<8sQQ")  # magic, records used, live records
+DATA_MAGIC = b"CHOCREG1"
+INDEX_HEADER = struct.Struct("<8sQQ")  # magic, capacity, entries
+INDEX_MAGIC = b"CHOCIDX1"
+INDEX_ENTRY = struct.Struct("<II")  # number + 1 (0 marks an empty entry), record slot
+
+def _number_key(number):
+    """Return the integer form of a 9-digit number, or None if it is not one"""
+    if len(number) != 9 or not number.isdigit():
+        return None
+    return int(number)
+
+def _encode(value, width):
+    data = str(value).encode("utf-8")[:width]
+    return data + b" " * (width - len(data))
+
+def _decode(data):
+    return data.decode("utf-8", errors="ignore").rstrip(" ")
+
+class _MappedFile:
+    """A file mapped into memory that grows by doubling"""
+
+    def __init__(self, path, header_size, initial_size, initialize):
+        self.path = path
+        new = not os.path.exists(path)
+        if new:
+            with open(path, "wb") as f:
+                f.truncate(header_size + initial_size)
+        self.file = open(path, "r+b")
+        if new:
+            initialize(self)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def resize(self, size):
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def ensure(self, size):
+        if size > len(self.map):
+            self.resize(max(size, len(self.map) * 2))
+
+    def write_raw(self, offset, data):
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+class FixedWidthRegistry(MutableMapping):
+    """
+    Member or provider records in a memory-mapped file of fixed-width
+    records, found through a memory-mapped open-addressing hash index.
+    Objects are built only when a number is looked up, so opening a
+    registry does not read its records.
+    """
+
+    def __init__(self, path, factory):
+        self.path = path
+        self.factory = factory  # Member or Provider
+        self.data = _MappedFile(
+            path + ".dat", HEADER.size, RECORD_SIZE * 1024,
+            lambda f: f.write_raw(0, HEADER.pack(DATA_MAGIC, 0, 0))
+        )
+        self.index = _MappedFile(
+            path + ".idx", INDEX_HEADER.size, INDEX_ENTRY.size * 2048,
+            lambda f: f.write_raw(0, INDEX_HEADER.pack(INDEX_MAGIC, 2048, 0))
+        )
+
+    # Header fields
+
+    def _counts(self):
+        _, used, live = HEADER.unpack_from(self.data.map, 0)
+        return used, live
+
+    def _set_counts(self, used, live):
+        HEADER.pack_into(self.data.map, 0, DATA_MAGIC, used, live)
+
+    def _record_offset(self, slot):
+        return HEADER.size + slot * RECORD_SIZE
+
+    # Hash index
+
+    def _probe(self, key):
+        """Return (entry position, record slot or None) for key"""
+        _, capacity, _ = INDEX_HEADER.unpack_from(self.index.map, 0)
+        mask = capacity - 1
+        position = (key * 2654435761) & mask
+        stored_key = key + 1
+        while True:
+            entry_key, slot = INDEX_ENTRY.unpack_from(
+                self.index.map, INDEX_HEADER.size + position * INDEX_ENTRY.size
+            )
+            if entry_key == 0:
+                return position, None
+            if entry_key == stored_key:
+                return position, slot
+            position = (position + 1) & mask
+
+    def _index_insert(self, key, slot):
+        _, capacity, entries = INDEX_HEADER.unpack_from(self.index.map, 0)
+        if (entries + 1) * 10 > capacity * 7:
+            self._rebuild_index(capacity * 2)
+            _, capacity, entries = INDEX_HEADER.unpack_from(self.index.map, 0)
+        position, _ = self._probe(key)
+        INDEX_ENTRY.pack_into(
+            self.index.map, INDEX_HEADER.size + position * INDEX_ENTRY.size, key + 1, slot
+        )
+        INDEX_HEADER.pack_into(self.index.map, 0, INDEX_MAGIC, capacity, entries + 1)
+
+    def _rebuild_index(self, capacity):
+        self.index.resize(INDEX_HEADER.size + capacity * INDEX_ENTRY.size)
+        self.index.map[INDEX_HEADER.size:] = bytes(capacity * INDEX_ENTRY.size)
+        INDEX_HEADER.pack_into(self.index.map, 0, INDEX_MAGIC, capacity, 0)
+
+        # Tombstoned records keep their entry so their slot is reused on re-add
+        used, _ = self._counts()
+        for slot in range(used):
+            offset = self._record_offset(slot) + 1
+            key = int(self.data.map[offset:offset + 9])
+            self._index_insert(key, slot)
+
+    def _slot(self, number):
+        key = _number_key(number)
+        if key is None:
+            return None
+        _, slot = self._probe(key)
+        return slot
+
+    # Record encoding
+
+    def _read(self, slot):
+        offset = self._record_offset(slot)
+        record = self.data.map[offset:offset + RECORD_SIZE]
+        if record[:1] == DELETED:
+            return None
+        values = {}
+        position = 1
+        for field, width in FIELDS:
+            values[field] = _decode(record[position:position + width])
+            position += width
+        item = self.factory(values["name"], values["number"], values["street"],
+                            values["city"], values["state"], values["zip_code"])
+        if record[:1] == SUSPENDED:
+            item.status = "suspended"
+        return item
+
+    def _encode_record(self, item):
+        flag = SUSPENDED if getattr(item, "status", "active") == "suspended" else ACTIVE
+        return flag + b"".join(_encode(getattr(item, field), width) for field, width in FIELDS) + b"\n"
+
+    # Mapping interface
+
+    def __getitem__(self, number):
+        slot = self._slot(number)
+        item = self._read(slot) if slot is not None else None
+        if item is None:
+            raise KeyError(number)
+        return item
+
+    def __contains__(self, number):
+        slot = self._slot(number)
+        if slot is None:
+            return False
+        offset = self._record_offset(slot)
+        return self.data.map[offset:offset + 1] != DELETED
+
+    def __setitem__(self, number, item):
+        key = _number_key(number)
+        if key is None:
+            raise ValueError(f"Registry numbers must be 9 digits: {number!r}")
+        record = self._encode_record(item)
+        used, live = self._counts()
+        _, slot = self._probe(key)
+        if slot is None:
+            slot = used
+            used += 1
+            self.data.ensure(self._record_offset(used))
+            self._index_insert(key, slot)
+            live += 1
+        elif self.data.map[self._record_offset(slot):self._record_offset(slot) + 1] == DELETED:
+            live += 1
+        offset = self._record_offset(slot)
+        self.data.map[offset:offset + RECORD_SIZE] = record
+        self._set_counts(used, live)
+
+    def __delitem__(self, number):
+        slot = self._slot(number)
+        offset = self._record_offset(slot) if slot is not None else None
+        if offset is None or self.data.map[offset:offset + 1] == DELETED:
+            raise KeyError(number)
+        self.data.map[offset:offset + 1] = DELETED
+        used, live = self._counts()
+        self._set_counts(used, live - 1)
+
+    def __iter__(self):
+        used, _ = self._counts()
+        for slot in range(used):
+            offset = self._record_offset(slot)
+            if self.data.map[offset:offset + 1] != DELETED:
+                yield self.data.map[offset + 1:offset + 10].decode("ascii")
+
+    def __len__(self):
+        return self._counts()[1]
+
+    def flush(self):
+        self.data.map.flush()
+        self.index.map.flush()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    # Worker processes reopen the files instead of pickling the mapping
+    def __getstate__(self):
+        return {"path": self.path, "factory": self.factory}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["factory"])
+
+class ProviderRegistry(FixedWidthRegistry):
+    """
+    Provider registry that keeps looked-up Provider objects alive, since
+    they also carry the open period's services and weekly totals
+    """
+
+    def __init__(self, path, factory):
+        super().__init__(path, factory)
+        self.live = {}
+
+    def __getitem__(self, number):
+        provider = self.live.get(number)
+        if provider is None:
+            provider = self.live[number] = super().__getitem__(number)
+        return provider
+
+    def __setitem__(self, number, provider):
+        super().__setitem__(number, provider)
+        self.live[number] = provider
+
+    def __delitem__(self, number):
+        super().__delitem__(number)
+        self.live.pop(number, None)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["live"] = self.live
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.live = state["live"]
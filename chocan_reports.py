@@ -0,0 +1,358 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from datetime import datetime
+from itertools import chain
+import time
+from chocan_aggregate import fee_to_cents, iter_by_provider
+
+def _report_records(data, start, end, history, **who):
+    # Archived periods first, then the open period, each in service date order
+    records = data.service_records.records_between(start, end, **who)
+    if history:
+        return chain(data.storage.history(start, end, before_period=data.period, **who),
+                     records)
+    return records
+
+def _name(entries, number):
+    # Records outlive deleted members, providers and service codes
+    entry = entries.get(number)
+    return "(deleted)" if entry is None else entry.name
+
+def _report_filename(name):
+    return f"{name}_{datetime.now().strftime('%Y%m%d')}_report.txt"
+
+def _write_text(filename, text):
+    # One write per file; reports are rendered to a string first
+    with open(filename, "w") as f:
+        f.write(text)
+    return filename
+
+def render_member_report(data, member_number, start=None, end=None, history=False):
+    """
+    Render one member report from any object holding the system's data,
+    optionally limited to service dates from start to end (date ordinals)
+    and optionally including archived periods
+    """
+    member = data.members[member_number]
+    lines = [
+        f"Member Report for {member.name}\n"
+        f"Member Number: {member.number}\n"
+        f"Address: {member.street}\n"
+        f"         {member.city}, {member.state} {member.zip_code}\n\n"
+        "Services Received:\n"
+    ]
+
+    # Services for this member, already sorted by service date
+    for record in _report_records(data, start, end, history, member_number=member_number):
+        lines.append(
+            f"Date: {record.service_date}\n"
+            f"Provider: {_name(data.providers, record.provider_number)}\n"
+            f"Service: {_name(data.services, record.service_code)}\n\n"
+        )
+    return "".join(lines)
+
+def write_member_report(data, member_number, start=None, end=None, history=False):
+    """Write one member report to its own file, named after the member"""
+    text = render_member_report(data, member_number, start, end, history)
+    return _write_text(_report_filename(data.members[member_number].name), text)
+
+def render_provider_report(data, provider_number, start=None, end=None, history=False):
+    """
+    Render one provider report from any object holding the system's data,
+    optionally limited to service dates from start to end (date ordinals)
+    and optionally including archived periods
+    """
+    provider = data.providers[provider_number]
+    lines = [
+        f"Provider Report for {provider.name}\n"
+        f"Provider Number: {provider.number}\n"
+        f"Address: {provider.street}\n"
+        f"         {provider.city}, {provider.state} {provider.zip_code}\n\n"
+        "Services Provided:\n"
+    ]
+
+    # Totals are summed from the records listed, so they always agree with them.
+    # Fees are the ones charged, as in the summary and EFT; the catalog may have changed since.
+    consultations = 0
+    cents = 0
+    for record in _report_records(data, start, end, history, provider_number=provider_number):
+        fee = record.fee_cents
+        if fee < 0:
+            service = data.services.get(record.service_code)
+            fee = 0 if service is None else fee_to_cents(service.fee)
+        lines.append(
+            f"Date of Service: {record.service_date}\n"
+            f"Computer DateTime: {record.current_datetime}\n"
+            f"Member: {_name(data.members, record.member_number)} (#{record.member_number})\n"
+            f"Service Code: {record.service_code}\n"
+            f"Fee: {_dollars(fee)}\n\n"
+        )
+        consultations += 1
+        cents += fee
+
+    lines.append(f"Total Consultations: {consultations}\n"
+                 f"Total Fees: {_dollars(cents)}\n")
+    return "".join(lines)
+
+def write_provider_report(data, provider_number, start=None, end=None, history=False):
+    """Write one provider report to its own file, named after the provider"""
+    text = render_provider_report(data, provider_number, start, end, history)
+    return _write_text(_report_filename(data.providers[provider_number].name), text)
+
+def _dollars(cents):
+    return f"${cents // 100}.{cents % 100:02d}"
+
+def render_summary_report(payments):
+    """Render the weekly summary from (number, name, consultations, cents) payments"""
+    lines = ["Weekly Summary Report\n\n"]
+    total_providers = 0
+    total_consultations = 0
+    total_cents = 0
+
+    for number, name, consultations, cents in payments:
+        total_providers += 1
+        total_consultations += consultations
+        total_cents += cents
+        lines.append(f"Provider: {name}\n"
+                     f"Consultations: {consultations}\n"
+                     f"Fees: {_dollars(cents)}\n\n")
+
+    lines.append(f"Total Providers: {total_providers}\n"
+                 f"Total Consultations: {total_consultations}\n"
+                 f"Total Fees: {_dollars(total_cents)}\n")
+    return "".join(lines)
+
+def write_summary_report(payments):
+    return _write_text(f"summary_report_{datetime.now().strftime('%Y%m%d')}.txt",
+                       render_summary_report(payments))
+
+def render_eft_report(payments):
+    """Render the EFT transfer listing from (number, name, consultations, cents) payments"""
+    return "".join(
+        f"Provider: {name}\n"
+        f"Number: {number}\n"
+        f"Transfer Amount: {_dollars(cents)}\n\n"
+        for number, name, consultations, cents in payments if cents > 0
+    )
+
+def write_eft_report(payments):
+    return _write_text(f"eft_data_{datetime.now().strftime('%Y%m%d')}.txt",
+                       render_eft_report(payments))
+
+def timed_report(report, number, write, *args):
+    """Run one report writer and return its manifest entry"""
+    start = time.perf_counter()
+    filename = write(*args)
+    return {
+        "report": report,
+        "number": number,
+        "filename": filename,
+        "seconds": time.perf_counter() - start,
+    }
+
+class VersionedMapping:
+    """
+    Read-only view of a members, providers or services mapping as it was
+    when a snapshot was taken. The system calls before_change() ahead of
+    every add, update or delete, which saves the old value (None for a
+    key that did not exist yet) the first time a key changes. Everything
+    else is read from the live mapping, so taking the view costs nothing.
+    """
+
+    def __init__(self, live):
+        self.live = live
+        self.saved = {}  # key: number or code, value: copy from before the first change
+
+    def before_change(self, key):
+        if key not in self.saved:
+            value = self.live.get(key)
+            self.saved[key] = None if value is None else copy.copy(value)
+
+    def __getstate__(self):
+        live = self.live
+        if isinstance(live, dict):
+            # A dict would be pickled while writers change it; ship the view's own copy
+            return {"live": {key: self[key] for key in self}, "saved": {}}
+        return {"live": live, "saved": dict(self.saved)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __getitem__(self, key):
+        saved = self.saved
+        if key in saved:
+            value = saved[key]
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.live[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        saved = list(self.saved.items())
+        added = {key for key, value in saved if value is None}
+        keys = [key for key in list(self.live) if key not in added]
+        live = set(keys) if saved else ()
+        keys.extend(key for key, value in saved if value is not None and key not in live)
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+class ReportSnapshot:
+    """
+    Point-in-time view of the data reports read: record rows stored so
+    far and versioned members, providers and services. Claims keep being
+    recorded while reports run against it. It is handed to each worker
+    process once, never per task.
+    """
+    __slots__ = ("storage", "period", "members", "providers", "services", "service_records",
+                 "__weakref__")
+
+    def __init__(self, storage, period, members, providers, services, service_records):
+        self.storage = storage
+        self.period = period
+        self.members = VersionedMapping(members)
+        self.providers = VersionedMapping(providers)
+        self.services = VersionedMapping(services)
+        self.service_records = service_records
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__[:-1]}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def payments(self):
+        """
+        Return (provider number, name, consultations, fee total in cents)
+        for each provider with services in the snapshot, in number order
+        """
+        return list(self.iter_payments())
+
+    def iter_payments(self):
+        """Yield the same payments one at a time, for writers that stream them"""
+        providers = self.providers
+        for number, consultations, cents in iter_by_provider(self.service_records.columns(),
+                                                              self.services):
+            provider = providers.get(number)
+            if provider is not None:
+                yield number, provider.name, consultations, cents
+
+_worker_snapshot = None
+
+def _init_worker(snapshot):
+    global _worker_snapshot
+    snapshot.storage.reopen()
+    _worker_snapshot = snapshot
+
+WRITERS = {"member": write_member_report, "provider": write_provider_report}
+RENDERERS = {"member": render_member_report, "provider": render_provider_report}
+
+def bundle_report(bundle, report, number, render, *args):
+    """Render one report into a BundleWriter and return its manifest entry"""
+    start = time.perf_counter()
+    bundle.add(report, number, render(*args))
+    return {
+        "report": report,
+        "number": number,
+        "filename": bundle.filename,
+        "seconds": time.perf_counter() - start,
+    }
+
+def timed_render(report, number, render, *args):
+    """Render one report for a bundle owned elsewhere; return (manifest entry, text)"""
+    start = time.perf_counter()
+    text = render(*args)
+    return {"report": report, "number": number,
+            "seconds": time.perf_counter() - start}, text
+
+def _write_chunk(report, numbers, bundled=False):
+    if not bundled:
+        return [
+            timed_report(report, number, WRITERS[report], _worker_snapshot, number)
+            for number in numbers
+        ]
+    # The parent owns the bundle; send back each manifest entry with its text
+    return [
+        timed_render(report, number, RENDERERS[report], _worker_snapshot, number)
+        for number in numbers
+    ]
+
+def _chunks(numbers, size):
+    for start in range(0, len(numbers), size):
+        yield numbers[start:start + size]
+
+def generate_reports_serial(data, member_numbers=None, provider_numbers=None, bundle=None):
+    """
+    Write member and provider reports (all of them by default) in this
+    process, each to its own file or all into bundle, a BundleWriter
+    """
+    if member_numbers is None:
+        member_numbers = list(data.members)
+    if provider_numbers is None:
+        provider_numbers = list(data.providers)
+
+    def report(kind, number):
+        if bundle is None:
+            return timed_report(kind, number, WRITERS[kind], data, number)
+        return bundle_report(bundle, kind, number, RENDERERS[kind], data, number)
+
+    manifest = [report("member", number) for number in member_numbers]
+    manifest.extend(report("provider", number) for number in provider_numbers)
+    return manifest
+
+def generate_reports_parallel(snapshot, member_numbers=None, provider_numbers=None,
+                              workers=4, chunk_size=None, bundle=None):
+    """
+    Split member and provider reports across a pool of worker processes.
+    With a BundleWriter the workers only render; this process appends
+    their output to the bundle in order.
+    """
+    if member_numbers is None:
+        member_numbers = list(snapshot.members)
+    if provider_numbers is None:
+        provider_numbers = list(snapshot.providers)
+    if not member_numbers and not provider_numbers:
+        return []
+    if chunk_size is None:
+        # A few chunks per worker keeps the pool busy without per-report overhead
+        total = len(member_numbers) + len(provider_numbers)
+        chunk_size = max(1, total // (workers * 4))
+
+    bundled = bundle is not None
+    manifest = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(snapshot,)) as pool:
+        futures = [
+            pool.submit(_write_chunk, "member", chunk, bundled)
+            for chunk in _chunks(member_numbers, chunk_size)
+        ]
+        futures.extend(
+            pool.submit(_write_chunk, "provider", chunk, bundled)
+            for chunk in _chunks(provider_numbers, chunk_size)
+        )
+        for future in futures:
+            if not bundled:
+                manifest.extend(future.result())
+                continue
+            for entry, text in future.result():
+                bundle.add(entry["report"], entry["number"], text)
+                entry["filename"] = bundle.filename
+                manifest.append(entry)
+    return manifest
@@ -0,0 +1,145 @@
+from bisect import bisect_left
+import threading
+
+SEPARATOR = "\x00"  # sorts before any character a name, city or ZIP can hold
+MAX_PENDING = 1024
+
+class _SortedKeys:
+    """
+    Sorted "value\\0number" strings for one field. New keys wait in a small
+    unsorted buffer and are merged in bulk, so a burst of adds costs one
+    sort instead of one list shift per key.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.pending = set()
+
+    def add(self, key):
+        self.pending.add(key)
+        if len(self.pending) > MAX_PENDING:
+            self.merge()
+
+    def remove(self, key):
+        if key in self.pending:
+            self.pending.discard(key)
+            return
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+
+    def merge(self):
+        # Timsort merges the sorted tail into the sorted keys in one linear pass
+        self.keys.extend(sorted(self.pending))
+        self.keys.sort()
+        self.pending.clear()
+
+    def count(self, prefix):
+        return (bisect_left(self.keys, prefix + "\uffff") - bisect_left(self.keys, prefix)
+                + len(self.pending))
+
+    def numbers(self, prefix, chunk=256):
+        """Yield the number of every key whose value starts with prefix"""
+        keys = self.keys
+        position = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "\uffff", position)
+        # Slice in chunks so a query that stops early does not copy the whole range
+        while position < end:
+            for key in keys[position:min(position + chunk, end)]:
+                yield key[key.index(SEPARATOR) + 1:]
+            position += chunk
+        for key in self.pending:
+            if key.startswith(prefix):
+                yield key[key.index(SEPARATOR) + 1:]
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+def _values(name, city, zip_code):
+    # A leading space lets " " + prefix in name test "some word starts with prefix"
+    return " " + _normalize(name), _normalize(city), str(zip_code)
+
+class SearchIndex:
+    """
+    Prefix index over the name words, city and ZIP code of members or
+    providers. Each field is a sorted array searched with bisect; a query
+    intersects the ranges of its fields, starting with the narrowest.
+    """
+
+    def __init__(self):
+        self.fields = {"name": _SortedKeys(), "city": _SortedKeys(), "zip_code": _SortedKeys()}
+        self.values = {}  # key: number, value: (" " + name, city, zip_code), normalized
+        self.lock = threading.Lock()
+
+    def _keys(self, number, values):
+        name, city, zip_code = values
+        for word in set(name.split()):
+            yield "name", word + SEPARATOR + number
+        yield "city", city + SEPARATOR + number
+        yield "zip_code", zip_code + SEPARATOR + number
+
+    def add(self, number, name, city, zip_code):
+        """Index an entry, replacing whatever was indexed for number before"""
+        values = _values(name, city, zip_code)
+        with self.lock:
+            self._remove(number)
+            self.values[number] = values
+            for field, key in self._keys(number, values):
+                self.fields[field].add(key)
+
+    def build(self, entries):
+        """Index many (number, name, city, zip_code) entries with one sort per field"""
+        with self.lock:
+            for number, name, city, zip_code in entries:
+                self._remove(number)
+                values = self.values[number] = _values(name, city, zip_code)
+                for field, key in self._keys(number, values):
+                    self.fields[field].pending.add(key)
+            for keys in self.fields.values():
+                keys.merge()
+
+    def remove(self, number):
+        with self.lock:
+            self._remove(number)
+
+    def _remove(self, number):
+        values = self.values.pop(number, None)
+        if values is not None:
+            for field, key in self._keys(number, values):
+                self.fields[field].remove(key)
+
+    def search(self, name="", city="", zip_code="", limit=50):
+        """
+        Return up to limit numbers whose name has a word starting with each
+        word of name, and whose city and ZIP start with city and zip_code
+        """
+        name = _normalize(name).split()
+        city = _normalize(city)
+        zip_code = str(zip_code).strip()
+        with self.lock:
+            ranges = [(self.fields["name"], word) for word in name]
+            if city:
+                ranges.append((self.fields["city"], city))
+            if zip_code:
+                ranges.append((self.fields["zip_code"], zip_code))
+            if not ranges:
+                return []
+            # Narrowest range first, so the intersection never grows past its size
+            ranges.sort(key=lambda r: r[0].count(r[1]))
+            keys, prefix = ranges[0]
+            matches = set(keys.numbers(prefix))
+            for keys, prefix in ranges[1:]:
+                if not matches:
+                    return []
+                matches = {number for number in keys.numbers(prefix) if number in matches}
+
+            # Listed in the narrowest field's order
+            found = []
+            keys, prefix = ranges[0]
+            for number in keys.numbers(prefix):
+                if number in matches:
+                    matches.discard(number)
+                    found.append(number)
+                    if len(found) >= limit:
+                        break
+            return found
@@ -0,0 +1,265 @@
+import argparse
+import json
+import queue
+import select
+import socket
+import socketserver
+import threading
+import time
+from chocan_cache import BloomFilter, ValidationCache
+from chocan_storage import SQLiteStorage
+from chocan_system import ChocAnSystem
+
+class ServiceRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One provider terminal connection. Each request and response is a single
+    line of JSON, e.g. {"op": "validate", "member_number": "123456789"}.
+    """
+    WATCH_POLL = 1.0  # seconds between checks that a quiet watcher is still connected
+
+    def handle(self):
+        system = self.server.system
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+                if op == "watch":
+                    self.watch(system)
+                    return
+                if op == "validate":
+                    result = system.validate_member(request["member_number"])
+                elif op == "metrics":
+                    result = system.metrics_snapshot()
+                elif op == "member_filter":
+                    result = system.member_filter().to_dict()
+                elif op == "process_service":
+                    result = system.process_service(
+                        request["member_number"],
+                        request["provider_number"],
+                        request["service_date"],
+                        request["service_code"],
+                        request.get("comments", "")
+                    )
+                else:
+                    result = f"Unknown operation: {op}"
+            except (ValueError, KeyError) as e:
+                result = f"Bad request: {e}"
+            self.wfile.write((json.dumps({"result": result}) + "\n").encode())
+
+    def watch(self, system):
+        """Stream member changes to this connection until the terminal goes away"""
+        changes = queue.Queue()
+
+        def push(member_number, result):
+            changes.put((member_number, result))
+
+        system.subscribe(push)
+        try:
+            self.wfile.write(b'{"result": "Watching"}\n')
+            while True:
+                try:
+                    member_number, result = changes.get(timeout=self.WATCH_POLL)
+                except queue.Empty:
+                    if self._disconnected():
+                        return
+                    continue
+                self.wfile.write((json.dumps(
+                    {"member_number": member_number, "result": result}
+                ) + "\n").encode())
+        except OSError:
+            pass
+        finally:
+            system.unsubscribe(push)
+
+    def _disconnected(self):
+        # A watcher sends nothing after its request, so a readable socket means EOF
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+
+class ServiceServer(socketserver.ThreadingTCPServer):
+    """Accept concurrent provider terminals, one thread per connection"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, system):
+        super().__init__(address, ServiceRequestHandler)
+        self.system = system
+
+class TerminalClient:
+    """Blocking client for one terminal connection"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection((host, port))
+        self.reader = self.sock.makefile("rb")
+        self.watcher = None
+
+    def request(self, **request):
+        self.sock.sendall((json.dumps(request) + "\n").encode())
+        return json.loads(self.reader.readline())["result"]
+
+    def validate(self, member_number):
+        return self.request(op="validate", member_number=member_number)
+
+    def process_service(self, member_number, provider_number, service_date,
+                        service_code, comments=""):
+        return self.request(
+            op="process_service",
+            member_number=member_number,
+            provider_number=provider_number,
+            service_date=service_date,
+            service_code=service_code,
+            comments=comments
+        )
+
+    def member_filter(self):
+        return BloomFilter.from_dict(self.request(op="member_filter"))
+
+    def watch(self, callback):
+        """
+        Open a second connection that receives member changes and pass each
+        one to callback(member_number, result) on a background thread
+        """
+        watcher = TerminalClient(self.host, self.port)
+        watcher.request(op="watch")
+
+        def run():
+            try:
+                for line in watcher.reader:
+                    change = json.loads(line)
+                    callback(change["member_number"], change["result"])
+            except (OSError, ValueError):
+                pass  # connection closed
+
+        threading.Thread(target=run, daemon=True).start()
+        self.watcher = watcher
+
+    def validation_cache(self, capacity=4096, ttl=300.0):
+        """Return a ValidationCache kept current by this server's change feed"""
+        cache = ValidationCache(self.validate, capacity, ttl)
+        # Watch before fetching the filter so no add falls between the two
+        self.watch(cache.apply)
+        cache.load_filter(self.member_filter())
+        return cache
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # also wakes a blocked watch thread
+        except OSError:
+            pass
+        self.reader.close()
+        self.sock.close()
+
+def load_test(host, port, member_numbers, provider_numbers, service_code="598470",
+              terminals=50, requests_per_terminal=200, service_date="11-01-2024"):
+    """
+    Drive the server from many concurrent terminals, alternating validate and
+    process-service requests, and report throughput and tail latency
+    """
+    latencies = [[] for _ in range(terminals)]
+    errors = [0] * terminals
+
+    def run_terminal(index):
+        client = TerminalClient(host, port)
+        provider_number = provider_numbers[index % len(provider_numbers)]
+        for i in range(requests_per_terminal):
+            member_number = member_numbers[(index + i) % len(member_numbers)]
+            start = time.perf_counter()
+            if i % 2 == 0:
+                result = client.validate(member_number)
+                ok = result == "Validated"
+            else:
+                result = client.process_service(
+                    member_number, provider_number, service_date, service_code
+                )
+                # Terminals cycle through a few members, so repeats are expected
+                ok = result.startswith("Service recorded") or result == "Duplicate claim"
+            latencies[index].append(time.perf_counter() - start)
+            if not ok:
+                errors[index] += 1
+        client.close()
+
+    threads = [threading.Thread(target=run_terminal, args=(i,)) for i in range(terminals)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples = sorted(latency for terminal in latencies for latency in terminal)
+
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+    return {
+        "requests": len(samples),
+        "errors": sum(errors),
+        "seconds": elapsed,
+        "requests_per_second": len(samples) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": samples[-1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="ChocAn provider service server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="run the service server")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=7314)
+    serve.add_argument("--data-dir", default="chocan_data")
+    serve.add_argument("--registry", action="store_true",
+                       help="keep members and providers in memory-mapped registry files")
+    serve.add_argument("--sqlite", metavar="PATH",
+                       help="keep all data in an SQLite database instead of the data directory")
+    serve.add_argument("--metrics", action="store_true", help="collect operation metrics")
+
+    load = subparsers.add_parser("load-test", help="run the load-test client")
+    load.add_argument("--host", default="127.0.0.1")
+    load.add_argument("--port", type=int, default=7314)
+    load.add_argument("--members", nargs="+", required=True)
+    load.add_argument("--providers", nargs="+", required=True)
+    load.add_argument("--service-code", default="598470")
+    load.add_argument("--terminals", type=int, default=50)
+    load.add_argument("--requests", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        if args.sqlite:
+            system = ChocAnSystem(storage=SQLiteStorage(args.sqlite))
+        else:
+            system = ChocAnSystem(args.data_dir, registry=args.registry)
+        if args.metrics:
+            system.enable_metrics()
+        server = ServiceServer((args.host, args.port), system)
+        print(f"Serving provider terminals on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            system.close()
+    else:
+        result = load_test(
+            args.host, args.port, args.members, args.providers,
+            service_code=args.service_code,
+            terminals=args.terminals,
+            requests_per_terminal=args.requests
+        )
+        print(f"Requests: {result['requests']} ({result['errors']} errors)")
+        print(f"Throughput: {result['requests_per_second']:.0f} requests/s")
+        print(f"Latency p50/p95/p99/max: {result['p50_ms']:.2f} / {result['p95_ms']:.2f} / "
+              f"{result['p99_ms']:.2f} / {result['max_ms']:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from heapq import merge
+import multiprocessing
+import os
+import threading
+import zlib
+from chocan_bundle import BundleWriter
+from chocan_eft import check_payments, write_eft_batch
+from chocan_records import datetime_to_timestamp, parse_date
+from chocan_reports import (
+    bundle_report,
+    generate_reports_serial,
+    render_eft_report,
+    render_member_report,
+    render_provider_report,
+    render_summary_report,
+    timed_render,
+    timed_report,
+    write_eft_report,
+    write_provider_report,
+    write_summary_report,
+)
+from chocan_system import ChocAnSystem, batch_rows
+
+def shard_for(member_number, shards):
+    """Return the shard that owns a member; crc32 is stable across processes"""
+    return zlib.crc32(str(member_number).zfill(9).encode()) % shards
+
+# Shard-side operations that need more than one ChocAnSystem call
+
+# Snapshot pinned by member_reports for the rest of a report run on this shard,
+# the change sets the run took, given back if it fails, and where it writes
+_run_snapshot = None
+_run_dirty = None
+_run_target = None
+
+def _provider_slices(system, provider_numbers, start_date=None, end_date=None, history=False,
+                     pinned=False):
+    # This shard's part of each provider report, read from one snapshot (the pinned
+    # one during a report run): the provider, its archived and open period records
+    # and the members they name
+    data = _run_snapshot if pinned else system.report_snapshot()
+    start, end = system._date_range(start_date, end_date)
+    slices = {}
+    for number in provider_numbers:
+        provider = data.providers.get(number)
+        if provider is None:
+            continue
+        archived = list(data.storage.history(start, end, provider_number=number,
+                                             before_period=data.period) if history else ())
+        records = list(data.service_records.records_between(start, end,
+                                                            provider_number=number))
+        members = {record.member_number: data.members[record.member_number]
+                   for record in archived + records if record.member_number in data.members}
+        slices[number] = (provider, archived, records, members)
+    return slices
+
+def _member_reports(system, incremental=False, bundle=None):
+    global _run_snapshot, _run_dirty, _run_target
+    target = system._report_target(bundle)
+    member_numbers, provider_numbers, snapshot, taken = system._changed_reports(incremental,
+                                                                                target)
+    # Provider slices and payments later in this run read the same snapshot
+    _run_snapshot = snapshot
+    _run_dirty = taken
+    _run_target = target
+    try:
+        if bundle is None:
+            return generate_reports_serial(snapshot, member_numbers, []), provider_numbers, None
+        # The router owns the bundle; send back each manifest entry with its text, and
+        # the numbers that still exist so it drops deleted ones from the old bundle
+        manifest = [timed_render("member", number, render_member_report, snapshot, number)
+                    for number in member_numbers]
+        return manifest, provider_numbers, (list(snapshot.members), list(snapshot.providers))
+    except BaseException:
+        _abort_run(system)
+        raise
+
+def _run_payments(system):
+    # Last step of a report run: payments from the pinned snapshot, which is then released
+    global _run_snapshot, _run_dirty, _run_target
+    snapshot, _run_snapshot = _run_snapshot, None
+    system._reports_target = _run_target
+    _run_dirty = _run_target = None
+    return snapshot.payments()
+
+def _abort_run(system):
+    # The run failed somewhere; release its snapshot and keep its changes for the next one
+    global _run_snapshot, _run_dirty, _run_target
+    if _run_dirty is not None:
+        system._restore_dirty(_run_dirty)
+    _run_snapshot = _run_dirty = _run_target = None
+
+def _period(system):
+    return system.period
+
+def _services(system, pinned=False):
+    services = _run_snapshot.services if pinned else system.services
+    return dict(services.items())
+
+SHARD_OPERATIONS = {
+    "provider_slices": _provider_slices,
+    "member_reports": _member_reports,
+    "run_payments": _run_payments,
+    "abort_run": _abort_run,
+    "period": _period,
+    "services": _services,
+}
+
+def _serve_shard(connection, data_dir, options):
+    """
+    Worker process loop: run (directory, operation, args, kwargs) requests
+    until told to stop. Reports are written to the router's working
+    directory, passed along with each request.
+    """
+    system = ChocAnSystem(data_dir, **options)
+    try:
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            directory, operation, args, kwargs = request
+            try:
+                if directory != os.getcwd():
+                    os.chdir(directory)
+                handler = SHARD_OPERATIONS.get(operation)
+                if handler is not None:
+                    result = handler(system, *args, **kwargs)
+                else:
+                    result = getattr(system, operation)(*args, **kwargs)
+                connection.send((True, result))
+            except Exception as e:
+                connection.send((False, e))
+    finally:
+        system.close()
+        connection.close()
+
+class _Shard:
+    """Router-side handle on one worker process; one request at a time"""
+
+    def __init__(self, index, data_dir, options):
+        self.index = index
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve_shard, args=(child, data_dir, options), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.lock = threading.Lock()
+
+    def send(self, operation, args, kwargs):
+        self.connection.send((os.getcwd(), operation, args, kwargs))
+
+    def receive(self):
+        ok, result = self.connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def call(self, operation, *args, **kwargs):
+        with self.lock:
+            self.send(operation, args, kwargs)
+            return self.receive()
+
+def _receive_all(shards):
+    # Read every reply before raising, so no pipe is left holding an unread one
+    replies = [shard.connection.recv() for shard in shards]
+    for ok, result in replies:
+        if not ok:
+            raise result
+    return [result for ok, result in replies]
+
+class _ReportView:
+    # The merged data one provider report reads, in write_provider_report's shape
+    __slots__ = ("members", "providers", "services", "service_records", "storage", "period")
+
+    def __init__(self, provider, archived, records, members, services):
+        self.period = None
+        self.members = members
+        self.providers = {provider.number: provider}
+        self.services = services
+        # The shards already selected the records; both lookups hand them back
+        self.service_records = self.storage = _FetchedRecords(archived, records)
+
+class _FetchedRecords:
+    __slots__ = ("archived", "records")
+
+    def __init__(self, archived, records):
+        self.archived = archived
+        self.records = records
+
+    def history(self, start=None, end=None, **who):
+        return self.archived
+
+    def records_between(self, start=None, end=None, **who):
+        return self.records
+
+def _by_service_date(record):
+    return parse_date(record.service_date)
+
+def _merge_payments(parts):
+    # Every shard's (number, name, consultations, cents) payments, summed per provider
+    merged = {}
+    for payments in parts:
+        for number, name, consultations, cents in payments:
+            _, _, count, total = merged.get(number, (number, name, 0, 0))
+            merged[number] = (number, name, count + consultations, total + cents)
+    return [merged[number] for number in sorted(merged)]
+
+class ShardedSystem:
+    """
+    ChocAn split across worker processes by member number. Each shard is a
+    ChocAnSystem in its own process that owns one partition of members and
+    their service records, so claims for different members are validated
+    and recorded on different cores. Providers and the service catalog are
+    copied to every shard. Provider totals, provider reports and the weekly
+    summary and EFT files are merged from all shards on demand.
+    """
+
+    def __init__(self, shards=None, data_dir=None, **options):
+        if shards is None:
+            shards = os.cpu_count() or 1
+        self.data_dir = data_dir
+        self.shards = []
+        for index in range(shards):
+            shard_dir = None
+            if data_dir is not None:
+                # Absolute, since a worker follows the router's working directory
+                shard_dir = os.path.join(os.path.abspath(data_dir), f"shard_{index:02d}")
+            self.shards.append(_Shard(index, shard_dir, options))
+        self._report_lock = threading.Lock()
+
+    def _shard(self, member_number):
+        return self.shards[shard_for(member_number, len(self.shards))]
+
+    @contextmanager
+    def _all_shards(self):
+        # Always locked in shard order, so concurrent fan-outs cannot deadlock
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.lock)
+            yield self.shards
+
+    def _broadcast_locked(self, operation, *args, **kwargs):
+        # Send to every shard before reading any reply, so they all work at once
+        for shard in self.shards:
+            shard.send(operation, args, kwargs)
+        return _receive_all(self.shards)
+
+    def _broadcast(self, operation, *args, **kwargs):
+        with self._all_shards():
+            return self._broadcast_locked(operation, *args, **kwargs)
+
+    def close(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.connection.send(None)
+                shard.connection.close()
+        for shard in self.shards:
+            shard.process.join()
+
+    # Members and claims go to the owning shard
+
+    def validate_member(self, member_number):
+        return self._shard(member_number).call("validate_member", member_number)
+
+    def process_service(self, member_number, provider_number, service_date, service_code,
+                        comments=""):
+        return self._shard(member_number).call(
+            "process_service", member_number, provider_number, service_date, service_code,
+            comments
+        )
+
+    def process_services_batch(self, stream, fmt="csv"):
+        """
+        Split a claim stream by member shard, let every shard record its
+        part at once and return (row, result) pairs in stream order
+        """
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError(f"Unsupported batch format: {fmt}")
+
+        parts = [[] for _ in self.shards]
+        positions = [[] for _ in self.shards]  # stream row number of each part's rows
+        results = []
+        for row_number, row in enumerate(batch_rows(stream, fmt), start=1):
+            if row is None:
+                results.append((row_number, "Invalid row"))
+                continue
+            index = shard_for(row.get("member_number", ""), len(self.shards))
+            parts[index].append(row)
+            positions[index].append(row_number)
+
+        with self._all_shards():
+            for shard, part in zip(self.shards, parts):
+                shard.send("process_services_batch", (part, "rows"), {})
+            replies = _receive_all(self.shards)
+
+        for numbers, reply in zip(positions, replies):
+            results.extend((numbers[row - 1], result) for row, result in reply)
+        results.sort()
+        return results
+
+    def add_member(self, name, number, street, city, state, zip_code):
+        return self._shard(number).call("add_member", name, number, street, city, state,
+                                        zip_code)
+
+    def update_member(self, member_number, **kwargs):
+        return self._shard(member_number).call("update_member", member_number, **kwargs)
+
+    def delete_member(self, member_number):
+        return self._shard(member_number).call("delete_member", member_number)
+
+    def search_members(self, name="", city="", zip_code="", limit=50):
+        found = self._broadcast("search_members", name, city, zip_code, limit)
+        return sorted((member for members in found for member in members),
+                      key=lambda member: member.number)[:limit]
+
+    def generate_member_report(self, member_number, start_date=None, end_date=None,
+                               history=False):
+        return self._shard(member_number).call("generate_member_report", member_number,
+                                               start_date, end_date, history)
+
+    # Providers and the service catalog are replicated to every shard
+
+    def _replicated(self, operation, *args, **kwargs):
+        return self._broadcast(operation, *args, **kwargs)[0]
+
+    def add_provider(self, name, number, street, city, state, zip_code):
+        return self._replicated("add_provider", name, number, street, city, state, zip_code)
+
+    def update_provider(self, provider_number, **kwargs):
+        return self._replicated("update_provider", provider_number, **kwargs)
+
+    def delete_provider(self, provider_number):
+        return self._replicated("delete_provider", provider_number)
+
+    def search_providers(self, name="", city="", zip_code="", limit=50):
+        return self.shards[0].call("search_providers", name, city, zip_code, limit)
+
+    def add_service(self, code, name, fee):
+        return self._replicated("add_service", code, name, fee)
+
+    def update_service(self, code, **kwargs):
+        return self._replicated("update_service", code, **kwargs)
+
+    def delete_service(self, code):
+        return self._replicated("delete_service", code)
+
+    def catalog_listing(self):
+        return self.shards[0].call("catalog_listing")
+
+    def generate_provider_directory(self):
+        return self.shards[0].call("generate_provider_directory")
+
+    # Anything about providers is merged from every shard
+
+    def provider_totals(self, period=None, provider_number=None, service_code=None,
+                        start_date=None, end_date=None):
+        """Sum every shard's {provider_number: (consultations, cents)}"""
+        merged = {}
+        for totals in self._broadcast("provider_totals", period, provider_number,
+                                      service_code, start_date, end_date):
+            for number, (consultations, cents) in totals.items():
+                count, total = merged.get(number, (0, 0))
+                merged[number] = (count + consultations, total + cents)
+        return merged
+
+    def _payments_locked(self):
+        return _merge_payments(self._broadcast_locked("payments"))
+
+    def payments(self):
+        with self._all_shards():
+            return self._payments_locked()
+
+    def services_between(self, start_date=None, end_date=None, member_number=None,
+                         provider_number=None, history=False):
+        if member_number is not None:
+            return self._shard(member_number).call(
+                "services_between", start_date, end_date, member_number, provider_number,
+                history
+            )
+        parts = self._broadcast("services_between", start_date, end_date, None,
+                                provider_number, history)
+        return list(merge(*parts, key=_by_service_date))
+
+    def _write_provider_reports(self, provider_numbers, start_date=None, end_date=None,
+                                history=False, bundle=None, pinned=False):
+        if not provider_numbers:
+            return []
+        slices = self._broadcast("provider_slices", provider_numbers, start_date, end_date,
+                                 history, pinned)
+        services = self.shards[0].call("services", pinned)
+        start = None if start_date is None else parse_date(start_date)
+        end = None if end_date is None else parse_date(end_date)
+
+        manifest = []
+        for number in provider_numbers:
+            parts = [part[number] for part in slices if number in part]
+            if not parts:
+                raise KeyError(number)
+            provider = parts[0][0]
+            # Archived records come period by period per shard, so order them by date outright
+            archived = sorted((record for part in parts for record in part[1]),
+                              key=_by_service_date)
+            records = list(merge(*(part[2] for part in parts), key=_by_service_date))
+            members = {}
+            for part in parts:
+                members.update(part[3])
+            view = _ReportView(provider, archived, records, members, services)
+            if bundle is None:
+                manifest.append(timed_report("provider", number, write_provider_report, view,
+                                             number, start, end, history))
+            else:
+                manifest.append(bundle_report(bundle, "provider", number,
+                                              render_provider_report, view, number, start,
+                                              end, history))
+        return manifest
+
+    def generate_provider_report(self, provider_number, start_date=None, end_date=None,
+                                 history=False):
+        manifest = self._write_provider_reports([provider_number], start_date, end_date,
+                                                history)
+        return manifest[0]["filename"]
+
+    def generate_summary_report(self):
+        return write_summary_report(self.payments())
+
+    def generate_eft_report(self):
+        return write_eft_report(self.payments())
+
+    def _write_eft_batch_locked(self, chunk_size=1000):
+        filename = f"eft_batch_{datetime.now().strftime('%Y%m%d')}.dat"
+        self.shards[0].send("period", (), {})
+        period = self.shards[0].receive()
+        write_eft_batch(filename, self._payments_locked(), period, chunk_size=chunk_size)
+        return filename
+
+    def generate_eft_batch(self, chunk_size=1000):
+        # Hold every shard so the control totals match the detail records
+        with self._all_shards():
+            return self._write_eft_batch_locked(chunk_size)
+
+    def generate_all_reports(self, incremental=False, bundle=None):
+        """
+        Every shard writes its own members' reports at once; provider
+        reports, the summary and the EFT report are then written from the
+        merged shard data. With bundle set to a file name the shards only
+        render member reports and every report goes into that bundle.
+        Returns the combined manifest.
+        """
+        # One run at a time, since each shard pins a single run's snapshot
+        with self._report_lock:
+            try:
+                if bundle is None:
+                    return self._generate_reports(incremental)
+                with BundleWriter(bundle) as writer:
+                    return self._generate_reports(incremental, writer)
+            except BaseException:
+                self._broadcast("abort_run")
+                raise
+
+    def _generate_reports(self, incremental, bundle=None):
+        # Each shard pins the snapshot its member reports read, and its provider
+        # slices and payments come from that snapshot too, so every report of the
+        # run agrees while claims keep arriving
+        manifest = []
+        provider_numbers = set()
+        members = set()
+        providers = set()
+        for reports, changed, existing in self._broadcast(
+                "member_reports", incremental, None if bundle is None else bundle.filename):
+            if bundle is None:
+                manifest.extend(reports)
+            else:
+                for entry, text in reports:
+                    bundle.add("member", entry["number"], text)
+                    entry["filename"] = bundle.filename
+                    manifest.append(entry)
+                members.update(existing[0])
+                providers.update(existing[1])
+            provider_numbers.update(changed)
+        manifest.extend(self._write_provider_reports(sorted(provider_numbers), bundle=bundle,
+                                                     pinned=True))
+        payments = _merge_payments(self._broadcast("run_payments"))
+        if bundle is None:
+            manifest.append(timed_report("summary", None, write_summary_report, payments))
+            manifest.append(timed_report("eft", None, write_eft_report, payments))
+        else:
+            manifest.append(bundle_report(bundle, "summary", None, render_summary_report,
+                                          payments))
+            manifest.append(bundle_report(bundle, "eft", None, render_eft_report, payments))
+            if incremental:
+                bundle.carry_forward(members, providers)
+        return manifest
+
+    def close_week(self, closed_at=None):
+        """
+        Write the merged summary, EFT report and EFT batch for the open
+        period, then close it on every shard with the same timestamp
+        """
+        if closed_at is None:
+            closed_at = datetime_to_timestamp(datetime.now())
+        with self._all_shards():
+            payments = self._payments_locked()
+            check_payments(payments)
+            reports = [
+                write_summary_report(payments),
+                write_eft_report(payments),
+                self._write_eft_batch_locked(),
+            ]
+            closed = self._broadcast_locked("close_week", closed_at, reports=False)
+        merged = dict(closed[0])
+        merged["records"] = sum(part["records"] for part in closed)
+        merged["flagged_duplicates"] = sum(part["flagged_duplicates"] for part in closed)
+        merged["reports"] = reports
+        return merged
@@ -0,0 +1,520 @@
+from array import array
+from collections.abc import MutableMapping
+import json
+import os
+import sqlite3
+import threading
+from chocan_aggregate import Columns
+from chocan_archive import SegmentArchive
+from chocan_records import Interner, RecordStore, ServiceRecord, format_date, format_datetime
+from chocan_registry import FixedWidthRegistry, ProviderRegistry
+
+class StorageBackend:
+    """
+    Where ChocAnSystem keeps its data. A backend supplies the members,
+    providers and services mappings and one record store per accounting
+    period. A durable backend persists every change itself; otherwise
+    ChocAnSystem protects it with the journal and snapshots.
+    """
+    durable = False
+
+    def new_record_store(self, period):
+        raise NotImplementedError
+
+    def active_providers(self, period):
+        """Return the providers that already have records in an open period"""
+        return set()
+
+    def archive_period(self, period, store):
+        """Move a closed period's records out of the hot set"""
+        raise NotImplementedError
+
+    def load_period(self, period):
+        """Return the record store of a closed period"""
+        raise NotImplementedError
+
+    def history(self, start=None, end=None, member_number=None, provider_number=None,
+                before_period=None):
+        """
+        Yield closed periods' records (only periods before before_period if
+        given), oldest period first, each in service date order
+        """
+        raise NotImplementedError
+
+    def load_meta(self):
+        """Return saved period metadata, or None"""
+        return None
+
+    def save_meta(self, meta):
+        pass
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        """Make this thread's writes durable before a change is acknowledged"""
+        pass
+
+    def reopen(self):
+        """Reconnect to underlying files in a freshly started worker process"""
+        pass
+
+    def close(self):
+        pass
+
+class MemoryStorage(StorageBackend):
+    """
+    Plain dicts and a columnar RecordStore, optionally with members and
+    providers in memory-mapped registry files. Closed periods become
+    compressed archive segments in the data directory, or in memory
+    without one.
+    """
+
+    def __init__(self, data_dir=None, registry=False):
+        self.data_dir = data_dir
+        self.registry = registry
+        if registry:
+            if data_dir is None:
+                raise ValueError("registry=True requires a data_dir")
+            # Imported here to avoid a cycle: Member and Provider live in chocan_system
+            from chocan_system import Member, Provider
+            os.makedirs(data_dir, exist_ok=True)
+            self.members = FixedWidthRegistry(os.path.join(data_dir, "members"), Member)
+            self.providers = ProviderRegistry(os.path.join(data_dir, "providers"), Provider)
+        else:
+            self.members = {}
+            self.providers = {}
+        self.services = {}
+        self.archive = SegmentArchive(data_dir)
+
+    def new_record_store(self, period):
+        return RecordStore()
+
+    def archive_period(self, period, store):
+        self.archive.write(period, store)
+
+    def load_period(self, period):
+        return self.archive.load(period)
+
+    def history(self, start=None, end=None, member_number=None, provider_number=None,
+                before_period=None):
+        return self.archive.records_between(start, end, member_number, provider_number,
+                                            before_period)
+
+    def flush(self):
+        if self.registry:
+            self.members.flush()
+            self.providers.flush()
+
+    def close(self):
+        if self.registry:
+            self.members.close()
+            self.providers.close()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    number TEXT PRIMARY KEY, name TEXT, street TEXT, city TEXT,
+    state TEXT, zip_code TEXT, status TEXT
+);
+CREATE TABLE IF NOT EXISTS providers (
+    number TEXT PRIMARY KEY, name TEXT, street TEXT, city TEXT,
+    state TEXT, zip_code TEXT, weekly_consultations INTEGER, weekly_fee_total REAL
+);
+CREATE TABLE IF NOT EXISTS services (code TEXT PRIMARY KEY, name TEXT, fee REAL);
+CREATE TABLE IF NOT EXISTS service_records (
+    id INTEGER PRIMARY KEY, period INTEGER, entered_at INTEGER, service_date INTEGER,
+    provider_number TEXT, member_number TEXT, service_code TEXT, comments TEXT,
+    fee_cents INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_by_member
+    ON service_records (period, member_number, service_date);
+CREATE INDEX IF NOT EXISTS records_by_provider
+    ON service_records (period, provider_number);
+CREATE INDEX IF NOT EXISTS records_by_date
+    ON service_records (period, service_date);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+class SQLiteTable(MutableMapping):
+    """Mapping from a table's primary key to objects built by factory"""
+
+    def __init__(self, storage, table, key, columns, factory):
+        self.storage = storage
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.factory = factory  # builds an object from one row of columns
+
+    def __getitem__(self, number):
+        row = self.storage.query_one(
+            f"SELECT {', '.join(self.columns)} FROM {self.table} WHERE {self.key} = ?",
+            (number,)
+        )
+        if row is None:
+            raise KeyError(number)
+        return self.factory(*row)
+
+    def __contains__(self, number):
+        return self.storage.query_one(
+            f"SELECT 1 FROM {self.table} WHERE {self.key} = ?", (number,)
+        ) is not None
+
+    def __setitem__(self, number, item):
+        placeholders = ", ".join("?" for _ in self.columns)
+        self.storage.execute(
+            f"INSERT OR REPLACE INTO {self.table} ({', '.join(self.columns)}) "
+            f"VALUES ({placeholders})",
+            tuple(getattr(item, column) for column in self.columns)
+        )
+
+    def __delitem__(self, number):
+        if number not in self:
+            raise KeyError(number)
+        self.storage.execute(f"DELETE FROM {self.table} WHERE {self.key} = ?", (number,))
+
+    def __iter__(self):
+        for (number,) in self.storage.query(f"SELECT {self.key} FROM {self.table} ORDER BY rowid"):
+            yield number
+
+    def __len__(self):
+        return self.storage.query_one(f"SELECT COUNT(*) FROM {self.table}")[0]
+
+class SQLiteProviders(SQLiteTable):
+    """
+    Provider table that keeps looked-up Provider objects alive, since they
+    carry the open period's services and totals; changed totals are
+    written back on every commit
+    """
+
+    def __init__(self, storage, factory):
+        super().__init__(
+            storage, "providers", "number",
+            ("name", "number", "street", "city", "state", "zip_code",
+             "weekly_consultations", "weekly_fee_total"),
+            factory
+        )
+        self.live = {}
+        self.stored = {}  # key: number, value: totals last written back
+
+    def __getitem__(self, number):
+        provider = self.live.get(number)
+        if provider is None:
+            provider = self.live[number] = super().__getitem__(number)
+            provider.services_provided = array("l", (
+                row for (row,) in self.storage.query(
+                    "SELECT id FROM service_records WHERE period = ? AND provider_number = ? "
+                    "ORDER BY id",
+                    (self.storage.period, number)
+                )
+            ))
+        return provider
+
+    def __setitem__(self, number, provider):
+        super().__setitem__(number, provider)
+        self.live[number] = provider
+
+    def __delitem__(self, number):
+        super().__delitem__(number)
+        self.live.pop(number, None)
+
+    def write_totals(self):
+        changed = []
+        for provider in self.live.values():
+            totals = (provider.weekly_consultations, provider.weekly_fee_total)
+            if self.stored.get(provider.number) != totals:
+                self.stored[provider.number] = totals
+                changed.append(totals + (provider.number,))
+        self.storage.cursor.executemany(
+            "UPDATE providers SET weekly_consultations = ?, weekly_fee_total = ? WHERE number = ?",
+            changed
+        )
+
+RECORD_COLUMNS = ("entered_at, service_date, provider_number, member_number, "
+                  "service_code, comments, fee_cents")
+
+def _record(entered_at, service_date, provider_number, member_number, service_code, comments,
+            fee_cents):
+    return ServiceRecord(format_datetime(entered_at), format_date(service_date),
+                         provider_number, member_number, service_code, comments,
+                         -1 if fee_cents is None else fee_cents)
+
+class SQLiteRecordStore:
+    """
+    One accounting period of the service_records table; rows are record
+    IDs. A snapshot reads only records with IDs up to last_id.
+    """
+
+    def __init__(self, storage, period, last_id=None):
+        self.storage = storage
+        self.period = period
+        self.last_id = last_id
+
+    def _where(self):
+        # WHERE clause and parameters selecting this store's records
+        if self.last_id is None:
+            return "period = ?", [self.period]
+        return "period = ? AND id <= ?", [self.period, self.last_id]
+
+    def snapshot(self):
+        """Return a read-only view of the records stored so far"""
+        last_id = self.storage.query_one("SELECT MAX(id) FROM service_records")[0]
+        return SQLiteRecordStore(self.storage, self.period, last_id or 0)
+
+    def append(self, entered_at, service_date, provider_number, member_number,
+               service_code, comments="", fee_cents=-1):
+        return self.storage.execute(
+            f"INSERT INTO service_records (period, {RECORD_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.period, entered_at, service_date, provider_number, member_number,
+             service_code, comments[:100], fee_cents)
+        )
+
+    def columns(self):
+        """Read this period's aggregation columns out of the table"""
+        providers = Interner()
+        codes = Interner()
+        provider_ids = array("l")
+        service_ids = array("l")
+        service_dates = array("l")
+        fee_cents = array("q")
+        where, params = self._where()
+        for provider_number, service_code, service_date, fee in self.storage.query(
+            "SELECT provider_number, service_code, service_date, fee_cents "
+            f"FROM service_records WHERE {where}", params
+        ):
+            provider_ids.append(providers.intern(provider_number))
+            service_ids.append(codes.intern(service_code))
+            service_dates.append(service_date)
+            fee_cents.append(-1 if fee is None else fee)
+        return Columns(providers.values, codes.values, provider_ids, service_ids,
+                       service_dates, fee_cents)
+
+    def __len__(self):
+        where, params = self._where()
+        return self.storage.query_one(
+            f"SELECT COUNT(*) FROM service_records WHERE {where}", params
+        )[0]
+
+    def __getitem__(self, row):
+        values = self.storage.query_one(
+            f"SELECT {RECORD_COLUMNS} FROM service_records WHERE id = ?", (row,)
+        )
+        if values is None:
+            raise IndexError(row)
+        return _record(*values)
+
+    def __iter__(self):
+        where, params = self._where()
+        for values in self.storage.query(
+            f"SELECT {RECORD_COLUMNS} FROM service_records WHERE {where} ORDER BY id", params
+        ):
+            yield _record(*values)
+
+    def records(self, rows):
+        """Yield the records with the given IDs, in the order given"""
+        rows = list(rows)
+        for start in range(0, len(rows), 500):
+            chunk = rows[start:start + 500]
+            found = {
+                values[0]: _record(*values[1:])
+                for values in self.storage.query(
+                    f"SELECT id, {RECORD_COLUMNS} FROM service_records "
+                    f"WHERE id IN ({', '.join('?' for _ in chunk)})",
+                    chunk
+                )
+            }
+            for row in chunk:
+                yield found[row]
+
+    def member_records(self, member_number):
+        """Yield a member's records in service date order, using the member index"""
+        where, params = self._where()
+        for values in self.storage.query(
+            f"SELECT {RECORD_COLUMNS} FROM service_records "
+            f"WHERE {where} AND member_number = ? ORDER BY service_date, id",
+            params + [member_number]
+        ):
+            yield _record(*values)
+
+    def claims(self, since):
+        where, params = self._where()
+        return self.storage.query(
+            "SELECT entered_at, member_number, provider_number, service_code, service_date "
+            f"FROM service_records WHERE {where} AND entered_at >= ?",
+            params + [since]
+        )
+
+    def member_numbers_seen(self):
+        where, params = self._where()
+        return [
+            number for (number,) in self.storage.query(
+                f"SELECT DISTINCT member_number FROM service_records WHERE {where}", params
+            )
+        ]
+
+    def provider_records(self, provider_number):
+        """Yield a provider's records in service date order"""
+        return self.records_between(provider_number=provider_number)
+
+    def records_between(self, start=None, end=None, member_number=None, provider_number=None):
+        """Yield records in service date order using the period/date indexes"""
+        where, params = self._where()
+        sql = f"SELECT {RECORD_COLUMNS} FROM service_records WHERE {where}"
+        for column, value in (("member_number", member_number),
+                              ("provider_number", provider_number)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(value)
+        if start is not None:
+            sql += " AND service_date >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND service_date <= ?"
+            params.append(end)
+        for values in self.storage.query(sql + " ORDER BY service_date, id", params):
+            yield _record(*values)
+
+    def drop_member(self, member_number):
+        pass  # History stays in the table; nothing is cached per member
+
+class SQLiteStorage(StorageBackend):
+    """
+    Everything in one SQLite database with indexes on member, provider
+    and date. Writes go into one open transaction, committed before a
+    change is acknowledged (commit), on flush() and every batch_size
+    writes. One commit covers the writes of every thread that made them
+    while it waited, so concurrent changes share it.
+    """
+    durable = True
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = threading.RLock()
+        self.written = 0  # writes so far
+        self.committed = 0  # writes covered by a commit
+        self.local = threading.local()  # per thread: written count after its last write
+        self.period = 1
+        self._connect()
+
+        # Imported here to avoid a cycle: the entity classes live in chocan_system
+        from chocan_system import Member, Provider, Service
+
+        def member(name, number, street, city, state, zip_code, status):
+            item = Member(name, number, street, city, state, zip_code)
+            item.status = status
+            return item
+
+        def provider(name, number, street, city, state, zip_code, consultations, fees):
+            item = Provider(name, number, street, city, state, zip_code)
+            item.weekly_consultations = consultations or 0
+            item.weekly_fee_total = fees or 0.0
+            return item
+
+        self.members = SQLiteTable(
+            self, "members", "number",
+            ("name", "number", "street", "city", "state", "zip_code", "status"),
+            member
+        )
+        self.providers = SQLiteProviders(self, provider)
+        self.services = SQLiteTable(self, "services", "code", ("code", "name", "fee"), Service)
+
+    def _connect(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.executescript(SCHEMA)
+        # Databases created before fees were stored per record
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(service_records)")}
+        if "fee_cents" not in columns:
+            self.connection.execute("ALTER TABLE service_records ADD COLUMN fee_cents INTEGER")
+        self.cursor = self.connection.cursor()
+        self.pending = 0
+
+    def execute(self, sql, params=()):
+        """Run one write inside the current batch and return its row ID"""
+        with self.lock:
+            if self.pending == 0:
+                self.cursor.execute("BEGIN")
+            self.cursor.execute(sql, params)
+            self.pending += 1
+            self.written += 1
+            self.local.written = self.written
+            row = self.cursor.lastrowid
+            if self.pending >= self.batch_size:
+                self.flush()
+            return row
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchone()
+
+    def flush(self):
+        """Commit the current batch of writes"""
+        with self.lock:
+            if self.pending == 0:
+                return
+            self.providers.write_totals()
+            self.cursor.execute("COMMIT")
+            self.pending = 0
+            self.committed = self.written
+
+    def commit(self):
+        with self.lock:
+            # Another thread's commit may already have covered these writes
+            if self.committed < getattr(self.local, "written", 0):
+                self.flush()
+
+    def new_record_store(self, period):
+        self.period = period
+        return SQLiteRecordStore(self, period)
+
+    def active_providers(self, period):
+        return {
+            number for (number,) in self.query(
+                "SELECT DISTINCT provider_number FROM service_records WHERE period = ?",
+                (period,)
+            )
+        }
+
+    def archive_period(self, period, store):
+        pass  # Closed periods stay in the table, reachable through the period index
+
+    def load_period(self, period):
+        return SQLiteRecordStore(self, period)
+
+    def history(self, start=None, end=None, member_number=None, provider_number=None,
+                before_period=None):
+        if before_period is None or before_period > self.period:
+            before_period = self.period
+        for period in range(1, before_period):
+            yield from SQLiteRecordStore(self, period).records_between(
+                start, end, member_number, provider_number
+            )
+
+    def load_meta(self):
+        row = self.query_one("SELECT value FROM meta WHERE key = 'periods'")
+        return json.loads(row[0]) if row else None
+
+    def save_meta(self, meta):
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('periods', ?)",
+                     (json.dumps(meta),))
+        self.flush()
+
+    def reopen(self):
+        self._connect()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    # Spawned worker processes open their own connection
+    def __getstate__(self):
+        return {"path": self.path, "batch_size": self.batch_size, "period": self.period}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["batch_size"])
+        self.period = state["period"]
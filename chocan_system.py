@@ -1,8 +1,38 @@
+from array import array
+from contextlib import ExitStack, contextmanager
+import csv
 from datetime import datetime
 import json
 import os
+import threading
+import weakref
+from chocan_aggregate import fee_to_cents, group_by_provider
+from chocan_bundle import BundleWriter
+from chocan_cache import BloomFilter
+from chocan_duplicates import DuplicateIndex
+from chocan_eft import check_payments, valid_provider_number, write_eft_batch
+from chocan_journal import Journal, SnapshotStore
+from chocan_metrics import Metrics
+from chocan_search import SearchIndex
+from chocan_storage import MemoryStorage
+from chocan_records import RecordStore, datetime_to_timestamp, parse_date
+from chocan_reports import (
+    ReportSnapshot,
+    bundle_report,
+    generate_reports_parallel,
+    generate_reports_serial,
+    render_eft_report,
+    render_summary_report,
+    timed_report,
+    write_eft_report,
+    write_member_report,
+    write_provider_report,
+    write_summary_report,
+)
 
 class Member:
+    __slots__ = ("name", "number", "street", "city", "state", "zip_code", "status")
+
     def __init__(self, name, number, street, city, state, zip_code):
         self.name = name[:25]  # Limit to 25 characters
         self.number = str(number).zfill(9)  # Ensure 9 digits
@@ -13,6 +43,9 @@ class Member:
         self.status = "active"  # or "suspended"
 
 class Provider:
+    __slots__ = ("name", "number", "street", "city", "state", "zip_code",
+                 "services_provided", "weekly_consultations", "weekly_fee_total")
+
     def __init__(self, name, number, street, city, state, zip_code):
         self.name = name[:25]
         self.number = str(number).zfill(9)
@@ -20,45 +53,487 @@ class Provider:
         self.city = city[:14]
         self.state = state[:2]
         self.zip_code = str(zip_code).zfill(5)
-        self.services_provided = []
+        self.services_provided = array("l")  # rows in ChocAnSystem.service_records
         self.weekly_consultations = 0
         self.weekly_fee_total = 0.0
 
 class Service:
+    __slots__ = ("code", "name", "fee")
+
     def __init__(self, code, name, fee):
         self.code = str(code).zfill(6)
         self.name = name[:20]
         self.fee = float(fee)
 
-class ServiceRecord:
-    def __init__(self, current_datetime, service_date, provider_number, 
-                 member_number, service_code, comments=""):
-        self.current_datetime = current_datetime
-        self.service_date = service_date
-        self.provider_number = provider_number
-        self.member_number = member_number
-        self.service_code = service_code
-        self.comments = comments[:100]  # Limit comments to 100 characters
+def batch_rows(stream, fmt="csv"):
+    """
+    Yield one dict per claim in a CSV (with a header row) or JSONL stream,
+    or in already parsed rows (fmt="rows"); a row that cannot be read as
+    a claim is yielded as None so it still gets its own result
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+    elif fmt == "rows":
+        for row in stream:
+            yield row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unsupported batch format: {fmt}")
 
 class ChocAnSystem:
-    def __init__(self):
-        self.members = {}  # key: member_number, value: Member object
-        self.providers = {}  # key: provider_number, value: Provider object
-        self.services = {}  # key: service_code, value: Service object
-        self.service_records = []
-        self._initialize_sample_data()
+    # Operations timed once metrics are enabled; report operations also count the
+    # files they write, see _count_reports
+    TIMED_OPERATIONS = (
+        "validate_member", "process_service", "process_services_batch",
+        "add_member", "add_provider", "delete_member", "delete_provider",
+        "update_member", "update_provider", "close_week",
+        "add_service", "update_service", "delete_service",
+    )
+    REPORT_OPERATIONS = (
+        "generate_member_report", "generate_provider_report",
+        "generate_provider_directory", "generate_eft_report",
+        "generate_summary_report", "generate_all_reports", "generate_eft_batch",
+    )
+
+    def __init__(self, data_dir=None, snapshot_interval=10000, lock_stripes=64,
+                 registry=False, storage=None, duplicate_mode="reject",
+                 duplicate_window=7 * 86400):
+        # Storage backend: in-memory by default, or e.g. an SQLiteStorage
+        if storage is None:
+            storage = MemoryStorage(data_dir, registry)
+        elif data_dir is not None and storage.durable:
+            raise ValueError("a durable storage backend does not use a data_dir journal")
+        self.storage = storage
+        self.members = storage.members  # key: member_number, value: Member object
+        self.providers = storage.providers  # key: provider_number, value: Provider object
+        self.services = storage.services  # key: service_code, value: Service object
+
+        # Accounting periods: service_records holds only the open one
+        self.period = 1
+        self.period_opened_at = datetime_to_timestamp(datetime.now())
+        self.closed_periods = []  # one summary dict per closed period
+        meta = storage.load_meta()
+        if meta is not None:
+            self._restore_meta(meta)
+        self.service_records = storage.new_record_store(self.period)
+        # Providers with services in the open period
+        self.active_providers = storage.active_providers(self.period)
+
+        # Members and providers whose reports changed since the last report run, and
+        # where that run wrote (see _report_target). Only a run to the same place can
+        # be incremental; until then every report counts as changed.
+        self.dirty_members = set()
+        self.dirty_providers = set()
+        self._reports_target = None
+
+        # Service catalog version; renderings of the catalog are cached per version
+        self.catalog_version = 0
+        self._catalog_cache = {}  # key: rendering, value: (version, result)
+        self._directory_file = None  # (version, filename) last written
+        if len(self.services) == 0:
+            self._initialize_sample_data()
+
+        # Sharded provider locks guard weekly totals; the append lock guards
+        # only the shared record store and member index
+        self._provider_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._append_lock = threading.Lock()
+
+        self._subscribers = []  # callbacks taking (member_number, validation result)
+        self._report_snapshots = weakref.WeakSet()  # open ReportSnapshots, see report_snapshot()
+
+        # Repeated claims (same member, provider, service code and date) entered
+        # within duplicate_window seconds are rejected, flagged, or allowed (None)
+        if duplicate_mode not in ("reject", "flag", None):
+            raise ValueError(f"Unknown duplicate_mode: {duplicate_mode}")
+        self.duplicate_mode = duplicate_mode
+        self.duplicates = DuplicateIndex(duplicate_window)
+        self.flagged_rows = set()  # open period rows recorded as possible duplicates
+
+        # Name/city/ZIP prefix indexes, built on the first search and kept in sync after
+        self._member_search = None
+        self._provider_search = None
+
+        # Durable state: snapshot + journal tail, only when a data directory is given.
+        # With registry=True members and providers live in memory-mapped files instead.
+        self.registry = registry
+        self.data_dir = data_dir
+        self.journal = None
+        self.snapshots = None
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_seq = 0
+        self._snapshot_due = False
+        self._snapshot_lock = threading.Lock()
+        self._replaying = False
+        if data_dir is not None:
+            self._load(data_dir)
+        self._index_recent_claims()
+
+        self.metrics = None  # opt-in, see enable_metrics
+
+    def enable_metrics(self):
+        """
+        Start timing every operation. Timed wrappers are installed on this
+        instance only, so a system without metrics pays nothing per call.
+        """
+        if self.metrics is None:
+            self.metrics = Metrics()
+            for name in self.TIMED_OPERATIONS + self.REPORT_OPERATIONS:
+                setattr(self, name, self.metrics.instrument(name, getattr(self, name)))
+        return self.metrics
+
+    def _count_reports(self, result):
+        # Called with the files actually written, so a cached file is not counted again
+        if self.metrics is not None:
+            self.metrics.count_reports(result)
+        return result
+
+    def disable_metrics(self):
+        for name in self.TIMED_OPERATIONS + self.REPORT_OPERATIONS:
+            self.__dict__.pop(name, None)
+        self.metrics = None
+
+    def metrics_snapshot(self):
+        """Return the current metrics as a JSON-serializable dict, or None when disabled"""
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot()
+
+    def subscribe(self, callback):
+        """
+        Push member changes to callback(member_number, result), where result
+        is what validate_member now returns. Terminal caches use this feed.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _member_changed(self, member_number):
+        if not self._subscribers or self._replaying:
+            return
+        # Call through the class so metrics do not count these as swipes
+        result = ChocAnSystem.validate_member(self, member_number)
+        for callback in list(self._subscribers):
+            callback(member_number, result)
+
+    def member_filter(self, error_rate=0.01):
+        """Return a Bloom filter of every member number, for terminal caches"""
+        return BloomFilter.from_numbers(self.members, error_rate)
+
+    def _search_index(self, kind):
+        attribute = f"_{kind}_search"
+        index = getattr(self, attribute)
+        if index is None:
+            index = SearchIndex()
+            entries = self.members if kind == "member" else self.providers
+            index.build(
+                (entry.number, entry.name, entry.city, entry.zip_code)
+                for entry in entries.values()
+            )
+            setattr(self, attribute, index)
+        return index
+
+    def _reindex(self, index, entry):
+        if index is not None:
+            index.add(entry.number, entry.name, entry.city, entry.zip_code)
+
+    def search_members(self, name="", city="", zip_code="", limit=50):
+        """Return members matching name word, city and ZIP prefixes"""
+        numbers = self._search_index("member").search(name, city, zip_code, limit)
+        return [self.members[number] for number in numbers if number in self.members]
+
+    def search_providers(self, name="", city="", zip_code="", limit=50):
+        """Return providers matching name word, city and ZIP prefixes"""
+        numbers = self._search_index("provider").search(name, city, zip_code, limit)
+        return [self.providers[number] for number in numbers if number in self.providers]
+
+    def _index_recent_claims(self):
+        # Claims recorded before this process started still count as repeats
+        now = datetime_to_timestamp(datetime.now())
+        claim_key = DuplicateIndex.claim_key
+        for entered_at, member_number, provider_number, service_code, service_date in sorted(
+            self.service_records.claims(now - self.duplicates.window)
+        ):
+            self.duplicates.add(
+                claim_key(member_number, provider_number, service_code, service_date), entered_at
+            )
+
+    def _is_duplicate(self, entered_at, member_number, provider_number, service_code,
+                      service_date, reserved):
+        # A new claim is reserved at once so a concurrent copy is caught; its key
+        # goes into reserved, to be released if the claim is never recorded
+        if self.duplicate_mode is None:
+            return False
+        key = DuplicateIndex.claim_key(member_number, provider_number, service_code, service_date)
+        if self.duplicates.check(key, entered_at):
+            return True
+        reserved.append(key)
+        return False
+
+    def _load(self, data_dir):
+        self.snapshots = SnapshotStore(data_dir)
+        self.journal = Journal(data_dir)
+
+        self._snapshot_seq, state = self.snapshots.load_latest()
+        if state is not None:
+            self._restore_state(state)
+
+        # Replay only the journal entries newer than the snapshot
+        self._replaying = True
+        try:
+            for seq, op, args in self.journal.replay(self._snapshot_seq):
+                if op == "process_service":
+                    self._record_service(**args)
+                elif op == "process_services_batch":
+                    self._record_services(**args)
+                else:
+                    getattr(self, op)(**args)
+        finally:
+            self._replaying = False
+        self.journal.open(self._snapshot_seq)
+
+    def _provider_lock(self, provider_number):
+        return self._provider_locks[hash(provider_number) % len(self._provider_locks)]
+
+    @contextmanager
+    def _exclusive(self):
+        # Always provider locks first, then the append lock, so callers never deadlock
+        with ExitStack() as stack:
+            for lock in self._provider_locks:
+                stack.enter_context(lock)
+            stack.enter_context(self._append_lock)
+            yield
+
+    def _journal(self, op, args):
+        # Only writes the entry; _commit waits for it once the caller's locks are released
+        if self.journal is None or self._replaying:
+            return None
+        seq = self.journal.write(op, args)
+        if seq - self._snapshot_seq >= self.snapshot_interval:
+            self._snapshot_due = True
+        return seq
+
+    def _commit(self, seq):
+        # Nothing is acknowledged before it is durable: its journal entry, or the
+        # backend's own commit for a durable backend
+        if seq is not None:
+            self.journal.wait(seq)
+        self.storage.commit()
+
+    def _maybe_snapshot(self):
+        # Snapshots need every lock, so they run only once the caller has released its own
+        if self._snapshot_due:
+            self.save_snapshot()
+
+    def _log(self, op, **args):
+        # Every mutator journals its change before returning to the caller
+        self._commit(self._journal(op, args))
+        self._maybe_snapshot()
+
+    def _capture_state(self):
+        # Runs under every lock, so it only takes what must be exact at the snapshot's
+        # seq: provider totals, the catalog, the record count (a view) and references
+        # to the members. _serialize_state expands the large parts after the locks are
+        # released; a member changed meanwhile is changed again by journal replay.
+        if self.registry:
+            # Registry files already hold member and provider details
+            members = None
+            providers = [self.providers[number] for number in self.active_providers
+                         if number in self.providers]
+        else:
+            members = list(self.members.values())
+            providers = self.providers.values()
+
+        return {
+            "members": members,
+            "providers": [
+                {
+                    "name": provider.name,
+                    "number": provider.number,
+                    "street": provider.street,
+                    "city": provider.city,
+                    "state": provider.state,
+                    "zip_code": provider.zip_code,
+                    "weekly_consultations": provider.weekly_consultations,
+                    "weekly_fee_total": provider.weekly_fee_total,
+                }
+                for provider in providers
+            ],
+            "services": [
+                {slot: getattr(service, slot) for slot in Service.__slots__}
+                for service in self.services.values()
+            ],
+            "service_records": self.service_records.snapshot(),
+            **self._capture_meta(),
+        }
+
+    def _serialize_state(self, state):
+        if state["members"] is not None:
+            state["members"] = [
+                {slot: getattr(member, slot) for slot in Member.__slots__}
+                for member in state["members"]
+            ]
+        state["service_records"] = state["service_records"].to_state()
+        return state
+
+    def _capture_meta(self):
+        return {
+            "period": self.period,
+            "period_opened_at": self.period_opened_at,
+            "closed_periods": list(self.closed_periods),
+        }
+
+    def _restore_meta(self, meta):
+        self.period = meta["period"]
+        self.period_opened_at = meta["period_opened_at"]
+        self.closed_periods = meta["closed_periods"]
+
+    def _restore_state(self, state):
+        # Refill the backend's mappings in place; they are shared with self.storage
+        if state["members"] is not None:
+            self.members.clear()
+            for data in state["members"]:
+                member = Member(data["name"], data["number"], data["street"],
+                                data["city"], data["state"], data["zip_code"])
+                member.status = data["status"]
+                self.members[member.number] = member
+
+        if not self.registry:
+            self.providers.clear()
+        for data in state["providers"]:
+            provider = self.providers.get(data["number"])
+            if provider is None:
+                provider = Provider(data["name"], data["number"], data["street"],
+                                    data["city"], data["state"], data["zip_code"])
+                self.providers[provider.number] = provider
+            provider.weekly_consultations = data["weekly_consultations"]
+            provider.weekly_fee_total = data["weekly_fee_total"]
+
+        self.services.clear()
+        for data in state["services"]:
+            self.services[data["code"]] = Service(data["code"], data["name"], data["fee"])
+        self.catalog_version += 1
+
+        self._restore_meta(state)
+
+        # Rebuild the open period's provider rows from the stored columns
+        self.service_records = RecordStore.from_state(state["service_records"])
+        self.active_providers = set()
+        provider_numbers = self.service_records.provider_numbers.values
+        for row, provider_id in enumerate(self.service_records.provider_ids):
+            provider = self.providers.get(provider_numbers[provider_id])
+            if provider is not None:
+                provider.services_provided.append(row)
+                self.active_providers.add(provider.number)
+
+    def save_snapshot(self):
+        """
+        Write a compact snapshot and truncate the journal behind it. Claims
+        are held back only while the state is captured; it is serialized
+        and written while they go on.
+        """
+        if self.journal is None:
+            return
+        # One snapshot at a time; a caller arriving during one has nothing to add
+        if not self._snapshot_lock.acquire(blocking=False):
+            return
+        try:
+            with self._exclusive():
+                self.storage.flush()
+                seq = self.journal.roll()
+                state = self._capture_state()
+                self._snapshot_seq = seq
+                self._snapshot_due = False
+            self.snapshots.save(seq, self._serialize_state(state))
+            self.journal.prune(seq)
+        finally:
+            self._snapshot_lock.release()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        self.storage.close()
+
+    def close_week(self, closed_at=None, reports=True):
+        """
+        Freeze the open accounting period, write its summary and EFT
+        reports (unless reports=False, when the caller writes them), move
+        its records out of memory and open the next period
+        """
+        if closed_at is None:
+            closed_at = datetime_to_timestamp(datetime.now())
+
+        with self._exclusive():
+            closed = {
+                "period": self.period,
+                "opened_at": self.period_opened_at,
+                "closed_at": closed_at,
+                "records": len(self.service_records),
+                "flagged_duplicates": len(self.flagged_rows),
+            }
+
+            # Provider totals cover exactly the period being closed
+            if reports and not self._replaying:
+                payments = self._take_snapshot().payments()
+                # Nothing is written and the week stays open if the batch cannot be
+                check_payments(payments)
+                closed["reports"] = self._count_reports([
+                    write_summary_report(payments),
+                    write_eft_report(payments),
+                    self._write_eft_batch(payments, self.period),
+                ])
+
+            self.storage.archive_period(self.period, self.service_records)
+
+            # The new period starts with empty reports for everyone who had services
+            self.dirty_providers.update(self.active_providers)
+            self.dirty_members.update(self.service_records.member_numbers_seen())
+
+            # Only providers that saw activity need their weekly state reset
+            for provider_number in self.active_providers:
+                provider = self.providers.get(provider_number)
+                if provider is not None:
+                    provider.services_provided = array("l")
+                    provider.weekly_consultations = 0
+                    provider.weekly_fee_total = 0.0
+            self.active_providers = set()
+            self.flagged_rows = set()
+
+            self.closed_periods.append(closed)
+            self.period += 1
+            self.period_opened_at = closed_at
+            self.service_records = self.storage.new_record_store(self.period)
+            self.storage.save_meta(self._capture_meta())
+            seq = self._journal("close_week", {"closed_at": closed_at})
+
+        self._commit(seq)
+        self._maybe_snapshot()
+        return closed
+
+    def load_period(self, period):
+        """Return the record store of a closed accounting period"""
+        return self.storage.load_period(period)
 
     def _initialize_sample_data(self):
         # Initialize some sample services
-        self.services = {
+        self.services.update({
             "598470": Service("598470", "Dietitian Session", 50.00),
             "883948": Service("883948", "Aerobics Session", 45.00),
-        }
+        })
 
     def validate_member(self, member_number):
-        if member_number not in self.members:
+        member = self.members.get(member_number)
+        if member is None:
             return "Invalid Number"
-        member = self.members[member_number]
         if member.status == "suspended":
             return "Member suspended"
         return "Validated"
@@ -73,144 +548,451 @@ class ChocAnSystem:
         if service_code not in self.services:
             return "Invalid service code"
 
+        try:
+            service_ordinal = parse_date(service_date)
+        except ValueError:
+            return "Invalid service date"
+
+        if provider_number not in self.providers:
+            return "Invalid provider number"
+
+        entered_at = datetime_to_timestamp(datetime.now())
+        reserved = []
+        duplicate = self._is_duplicate(entered_at, member_number, provider_number,
+                                       service_code, service_ordinal, reserved)
+        if duplicate and self.duplicate_mode == "reject":
+            return "Duplicate claim"
+
         # Create service record
-        current_datetime = datetime.now()
-        record = ServiceRecord(
-            current_datetime.strftime("%m-%d-%Y %H:%M:%S"),
-            service_date,
-            provider_number,
-            member_number,
-            service_code,
-            comments
-        )
-        self.service_records.append(record)
-        
-        # Update provider's weekly totals
+        try:
+            row = self._record_service(
+                entered_at,
+                service_ordinal,
+                provider_number,
+                member_number,
+                service_code,
+                comments
+            )
+        except BaseException:
+            self.duplicates.release(reserved, entered_at)
+            raise
+        self._maybe_snapshot()
+
+        fee = f"Service recorded. Fee: ${self.services[service_code].fee:.2f}"
+        if duplicate:
+            self.flagged_rows.add(row)
+            return f"{fee} (flagged as possible duplicate)"
+        return fee
+
+    def _record_service(self, entered_at, service_date, provider_number,
+                        member_number, service_code, comments=""):
         provider = self.providers[provider_number]
-        provider.services_provided.append(record)
-        provider.weekly_consultations += 1
-        provider.weekly_fee_total += self.services[service_code].fee
+        with self._provider_lock(provider_number):
+            with self._append_lock:
+                row = self.service_records.append(
+                    entered_at,
+                    service_date,
+                    provider_number,
+                    member_number,
+                    service_code,
+                    comments,
+                    fee_to_cents(self.services[service_code].fee)
+                )
+            # The journal has its own lock. Snapshots hold every provider lock, so
+            # none sees this row without its entry.
+            seq = self._journal("process_service", {
+                "entered_at": entered_at,
+                "service_date": service_date,
+                "provider_number": provider_number,
+                "member_number": member_number,
+                "service_code": service_code,
+                "comments": comments[:100],
+            })
 
-        return f"Service recorded. Fee: ${self.services[service_code].fee:.2f}"
+            # Update provider's weekly totals
+            self.active_providers.add(provider_number)
+            self.dirty_providers.add(provider_number)
+            self.dirty_members.add(member_number)
+            provider.services_provided.append(row)
+            provider.weekly_consultations += 1
+            provider.weekly_fee_total += self.services[service_code].fee
 
-    def generate_member_report(self, member_number):
-        member = self.members[member_number]
-        filename = f"{member.name}_{datetime.now().strftime('%Y%m%d')}_report.txt"
+        # Wait for the fsync holding no lock; concurrent claims share it
+        self._commit(seq)
+        return row
 
-        with open(filename, "w") as f:
-            f.write(f"Member Report for {member.name}\n")
-            f.write(f"Member Number: {member.number}\n")
-            f.write(f"Address: {member.street}\n")
-            f.write(f"         {member.city}, {member.state} {member.zip_code}\n\n")
-            f.write("Services Received:\n")
-            
-            # Filter and sort services for this member
-            member_services = [
-                record for record in self.service_records 
-                if record.member_number == member_number
-            ]
-            member_services.sort(key=lambda x: x.service_date)
+    def process_services_batch(self, stream, fmt="csv"):
+        """
+        Validate and record a stream of claims (CSV with a header row,
+        JSONL, or fmt="rows" for already parsed dicts), returning one
+        (row, result) pair per claim
+        """
+        entered_at = datetime_to_timestamp(datetime.now())
+        reserved = []  # claim keys this batch reserved in the duplicate index
+        try:
+            results, accepted, flagged = self._validate_batch(
+                batch_rows(stream, fmt), entered_at, reserved
+            )
+            # Append every accepted claim in one step under a single timestamp
+            rows = self._record_services(entered_at, accepted) if accepted else []
+        except BaseException:
+            # Nothing was recorded, so none of the batch's claims may count as repeats
+            self.duplicates.release(reserved, entered_at)
+            raise
+        self.flagged_rows.update(rows[position] for position in flagged)
+        self._maybe_snapshot()
+        return results
 
-            for record in member_services:
-                service = self.services[record.service_code]
-                provider = self.providers[record.provider_number]
-                f.write(f"Date: {record.service_date}\n")
-                f.write(f"Provider: {provider.name}\n")
-                f.write(f"Service: {service.name}\n\n")
+    def _validate_batch(self, rows, entered_at, reserved):
+        # Returns (row, result) pairs, the accepted claims and the positions of flagged
+        # ones. Lookups are bound once for the whole batch.
+        members = self.members
+        providers = self.providers
+        services = self.services
 
-    def generate_provider_report(self, provider_number):
-        provider = self.providers[provider_number]
-        filename = f"{provider.name}_{datetime.now().strftime('%Y%m%d')}_report.txt"
+        results = []
+        accepted = []
+        flagged = []  # positions in accepted
+        for row_number, row in enumerate(rows, start=1):
+            if row is None:
+                results.append((row_number, "Invalid row"))
+                continue
+            member_number = str(row.get("member_number", ""))
+            provider_number = str(row.get("provider_number", ""))
+            service_code = str(row.get("service_code", ""))
 
-        with open(filename, "w") as f:
-            f.write(f"Provider Report for {provider.name}\n")
-            f.write(f"Provider Number: {provider.number}\n")
-            f.write(f"Address: {provider.street}\n")
-            f.write(f"         {provider.city}, {provider.state} {provider.zip_code}\n\n")
-            f.write("Services Provided:\n")
-
-            for record in provider.services_provided:
-                service = self.services[record.service_code]
-                member = self.members[record.member_number]
-                f.write(f"Date of Service: {record.service_date}\n")
-                f.write(f"Computer DateTime: {record.current_datetime}\n")
-                f.write(f"Member: {member.name} (#{record.member_number})\n")
-                f.write(f"Service Code: {record.service_code}\n")
-                f.write(f"Fee: ${service.fee:.2f}\n\n")
-
-            f.write(f"Total Consultations: {provider.weekly_consultations}\n")
-            f.write(f"Total Fees: ${provider.weekly_fee_total:.2f}\n")
+            member = members.get(member_number)
+            if member is None:
+                results.append((row_number, "Invalid Number"))
+            elif member.status == "suspended":
+                results.append((row_number, "Member suspended"))
+            elif provider_number not in providers:
+                results.append((row_number, "Invalid provider number"))
+            elif service_code not in services:
+                results.append((row_number, "Invalid service code"))
+            else:
+                try:
+                    service_ordinal = parse_date(str(row.get("service_date", "")))
+                except ValueError:
+                    results.append((row_number, "Invalid service date"))
+                    continue
+                # Repeats are caught within the batch too, since each claim is reserved
+                fee = f"Service recorded. Fee: ${services[service_code].fee:.2f}"
+                if self._is_duplicate(entered_at, member_number, provider_number,
+                                      service_code, service_ordinal, reserved):
+                    if self.duplicate_mode == "reject":
+                        results.append((row_number, "Duplicate claim"))
+                        continue
+                    flagged.append(len(accepted))
+                    fee += " (flagged as possible duplicate)"
+                accepted.append([
+                    service_ordinal,
+                    provider_number,
+                    member_number,
+                    service_code,
+                    str(row.get("comments") or "")[:100],
+                ])
+                results.append((row_number, fee))
+        return results, accepted, flagged
+
+    def _record_services(self, entered_at, rows):
+        recorded = []
+        with self._exclusive():
+            store = self.service_records
+            for service_date, provider_number, member_number, service_code, comments in rows:
+                row = store.append(
+                    entered_at,
+                    service_date,
+                    provider_number,
+                    member_number,
+                    service_code,
+                    comments,
+                    fee_to_cents(self.services[service_code].fee)
+                )
+
+                provider = self.providers[provider_number]
+                self.active_providers.add(provider_number)
+                self.dirty_providers.add(provider_number)
+                self.dirty_members.add(member_number)
+                provider.services_provided.append(row)
+                provider.weekly_consultations += 1
+                provider.weekly_fee_total += self.services[service_code].fee
+                recorded.append(row)
+
+            seq = self._journal("process_services_batch", {"entered_at": entered_at, "rows": rows})
+        self._commit(seq)
+        return recorded
+
+    def generate_member_report(self, member_number, start_date=None, end_date=None,
+                               history=False):
+        start, end = self._date_range(start_date, end_date)
+        return self._count_reports(
+            write_member_report(self.report_snapshot(), member_number, start, end, history))
+
+    def generate_provider_report(self, provider_number, start_date=None, end_date=None,
+                                 history=False):
+        start, end = self._date_range(start_date, end_date)
+        return self._count_reports(
+            write_provider_report(self.report_snapshot(), provider_number, start, end, history))
+
+    def _date_range(self, start_date, end_date):
+        # MM-DD-YYYY strings to ordinals; None leaves that end open
+        return (None if start_date is None else parse_date(start_date),
+                None if end_date is None else parse_date(end_date))
+
+    def services_between(self, start_date=None, end_date=None, member_number=None,
+                         provider_number=None, history=False):
+        """
+        Return the open period's services with start_date <= service date
+        <= end_date (MM-DD-YYYY, inclusive), optionally for one member or
+        provider, in service date order. With history=True closed periods
+        come first, read from the archive segments that can match.
+        """
+        start, end = self._date_range(start_date, end_date)
+        records = list(self.storage.history(start, end, member_number, provider_number)
+                       if history else ())
+        records.extend(self.service_records.records_between(
+            start, end, member_number=member_number, provider_number=provider_number
+        ))
+        return records
+
+    def provider_totals(self, period=None, provider_number=None, service_code=None,
+                        start_date=None, end_date=None):
+        """
+        Recompute {provider_number: (consultations, fee total in cents)}
+        from the service records of the open period, or of a closed one,
+        optionally for one provider, one service code or a date range
+        """
+        if period is None or period == self.period:
+            store = self.service_records
+        else:
+            store = self.storage.load_period(period)
+        start, end = self._date_range(start_date, end_date)
+        return group_by_provider(store.columns(), self.services, provider_number,
+                                 service_code, start, end)
+
+    def payments(self):
+        """
+        Return (provider number, name, consultations, fee total in cents)
+        for each provider with services this period, in number order
+        """
+        return self.report_snapshot().payments()
+
+    def report_snapshot(self):
+        """
+        Return a ReportSnapshot of the open period: the records stored so
+        far and members, providers and services as they are now. Taking
+        one only holds the append lock for a moment; reports then read it
+        while claims keep being recorded.
+        """
+        with self._append_lock:
+            return self._take_snapshot()
+
+    def _take_snapshot(self):
+        # Callers hold the append lock, so the record count covers whole, indexed rows
+        snapshot = ReportSnapshot(self.storage, self.period, self.members, self.providers,
+                                  self.services, self.service_records.snapshot())
+        self._report_snapshots.add(snapshot)
+        return snapshot
+
+    def _before_change(self, kind, key):
+        # Open snapshots save the old value before members, providers or services change
+        for snapshot in list(self._report_snapshots):
+            getattr(snapshot, kind).before_change(key)
+
+    def generate_all_reports(self, workers=1, incremental=False, bundle=None):
+        """
+        Write every member and provider report, then the summary and EFT
+        reports, and return a manifest of the files written with timings.
+        With incremental=True only reports changed since the last run are
+        rewritten; other files are left alone. With bundle set to a file
+        name, all reports of the run go into that one bundle file instead
+        (read them back with chocan_bundle.BundleReader); an incremental
+        run carries the unchanged reports over from the previous bundle.
+        """
+        # Every report in the run reads the same snapshot; claims keep being recorded
+        target = self._report_target(bundle)
+        member_numbers, provider_numbers, snapshot, taken = self._changed_reports(incremental,
+                                                                                  target)
+        try:
+            if bundle is None:
+                manifest = self._generate_reports(snapshot, member_numbers, provider_numbers,
+                                                  workers)
+                payments = snapshot.payments()
+                manifest.append(timed_report("summary", None, write_summary_report, payments))
+                manifest.append(timed_report("eft", None, write_eft_report, payments))
+            else:
+                with BundleWriter(bundle) as writer:
+                    manifest = self._generate_reports(snapshot, member_numbers,
+                                                      provider_numbers, workers, writer)
+                    payments = snapshot.payments()
+                    manifest.append(bundle_report(writer, "summary", None,
+                                                  render_summary_report, payments))
+                    manifest.append(bundle_report(writer, "eft", None, render_eft_report,
+                                                  payments))
+                    if incremental:
+                        writer.carry_forward(snapshot.members, snapshot.providers)
+        except BaseException:
+            self._restore_dirty(taken)
+            raise
+        self._reports_target = target
+        return self._count_reports(manifest)
+
+    def _generate_reports(self, snapshot, member_numbers, provider_numbers, workers,
+                          bundle=None):
+        if workers > 1:
+            # Workers read through their own handles, so commit pending writes first
+            self.storage.flush()
+            return generate_reports_parallel(snapshot, member_numbers, provider_numbers,
+                                             workers, bundle=bundle)
+        return generate_reports_serial(snapshot, member_numbers, provider_numbers, bundle)
+
+    def _report_target(self, bundle):
+        # Report files land in the working directory; a bundle is one file
+        if bundle is None:
+            return ("files", os.getcwd())
+        return ("bundle", os.path.abspath(bundle))
+
+    def _changed_reports(self, incremental, target):
+        # Take the change sets before the snapshot, so anything changed after it is
+        # kept for the next run. The sets taken are returned too; hand them to
+        # _restore_dirty if the run fails.
+        dirty_members, self.dirty_members = self.dirty_members, set()
+        dirty_providers, self.dirty_providers = self.dirty_providers, set()
+        taken = (dirty_members, dirty_providers)
+        snapshot = self.report_snapshot()
+        members = snapshot.members
+        providers = snapshot.providers
+        if incremental and self._reports_target == target:
+            return (sorted(number for number in dirty_members if number in members),
+                    sorted(number for number in dirty_providers if number in providers),
+                    snapshot, taken)
+        return list(members), list(providers), snapshot, taken
+
+    def _restore_dirty(self, taken):
+        # A failed run wrote none of its reports for sure; mark them for the next one
+        dirty_members, dirty_providers = taken
+        self.dirty_members.update(dirty_members)
+        self.dirty_providers.update(dirty_providers)
+
+    def _cached_catalog(self, rendering, build):
+        version = self.catalog_version
+        cached = self._catalog_cache.get(rendering)
+        if cached is None or cached[0] != version:
+            cached = self._catalog_cache[rendering] = (version, build())
+        return cached[1]
+
+    def service_catalog(self):
+        """Return the services sorted by name, rebuilt only when the catalog changes"""
+        return self._cached_catalog(
+            "sorted", lambda: sorted(self.services.values(), key=lambda x: x.name)
+        )
+
+    def catalog_listing(self):
+        """Return the terminal's one-line-per-service catalog listing"""
+        return self._cached_catalog("listing", lambda: "".join(
+            f"{code}: {service.name} - ${service.fee:.2f}\n"
+            for code, service in self.services.items()
+        ))
+
+    def _render_directory(self):
+        lines = ["ChocAn Provider Directory\n\n"]
+        for service in self.service_catalog():
+            lines.append(f"Service: {service.name}\n")
+            lines.append(f"Code: {service.code}\n")
+            lines.append(f"Fee: ${service.fee:.2f}\n\n")
+        return "".join(lines)
 
     def generate_provider_directory(self):
         filename = f"provider_directory_{datetime.now().strftime('%Y%m%d')}.txt"
-        
+        version = self.catalog_version
+
+        # The file on disk is still current unless the catalog changed
+        if self._directory_file == (version, filename) and os.path.exists(filename):
+            return filename
+        text = self._cached_catalog("directory", self._render_directory)
         with open(filename, "w") as f:
-            f.write("ChocAn Provider Directory\n\n")
-            
-            # Sort services by name
-            sorted_services = sorted(
-                self.services.values(), 
-                key=lambda x: x.name
-            )
-            
-            for service in sorted_services:
-                f.write(f"Service: {service.name}\n")
-                f.write(f"Code: {service.code}\n")
-                f.write(f"Fee: ${service.fee:.2f}\n\n")
+            f.write(text)
+        self._directory_file = (version, filename)
+        return self._count_reports(filename)
 
     def generate_eft_report(self):
-        filename = f"eft_data_{datetime.now().strftime('%Y%m%d')}.txt"
-        
-        with open(filename, "w") as f:
-            for provider in self.providers.values():
-                if provider.weekly_fee_total > 0:
-                    f.write(f"Provider: {provider.name}\n")
-                    f.write(f"Number: {provider.number}\n")
-                    f.write(f"Transfer Amount: ${provider.weekly_fee_total:.2f}\n\n")
+        return self._count_reports(write_eft_report(self.payments()))
+
+    def generate_eft_batch(self, chunk_size=1000):
+        """
+        Write the fixed-width EFT batch file (header, one detail record per
+        provider to pay, trailer with count and hash total) in chunks
+        """
+        # Totals come from one snapshot, so they match the detail records without
+        # holding claims back. Payments are streamed, never built as one list.
+        snapshot = self.report_snapshot()
+        return self._count_reports(
+            self._write_eft_batch(snapshot.iter_payments(), snapshot.period, chunk_size))
+
+    def _write_eft_batch(self, payments, period, chunk_size=1000):
+        filename = f"eft_batch_{datetime.now().strftime('%Y%m%d')}.dat"
+        write_eft_batch(filename, payments, period, chunk_size=chunk_size)
+        return filename
 
     def generate_summary_report(self):
-        filename = f"summary_report_{datetime.now().strftime('%Y%m%d')}.txt"
-        
-        total_providers = 0
-        total_consultations = 0
-        total_fees = 0.0
-        
-        with open(filename, "w") as f:
-            f.write("Weekly Summary Report\n\n")
-            
-            for provider in self.providers.values():
-                if provider.weekly_consultations > 0:
-                    total_providers += 1
-                    total_consultations += provider.weekly_consultations
-                    total_fees += provider.weekly_fee_total
-                    
-                    f.write(f"Provider: {provider.name}\n")
-                    f.write(f"Consultations: {provider.weekly_consultations}\n")
-                    f.write(f"Fees: ${provider.weekly_fee_total:.2f}\n\n")
-            
-            f.write(f"Total Providers: {total_providers}\n")
-            f.write(f"Total Consultations: {total_consultations}\n")
-            f.write(f"Total Fees: ${total_fees:.2f}\n")
+        return self._count_reports(write_summary_report(self.payments()))
 
     def add_member(self, name, number, street, city, state, zip_code):
         member = Member(name, number, street, city, state, zip_code)
+        self._before_change("members", member.number)
         self.members[member.number] = member
+        self.dirty_members.add(member.number)
+        self._reindex(self._member_search, member)
+        self._log("add_member", name=name, number=number, street=street,
+                  city=city, state=state, zip_code=zip_code)
+        self._member_changed(member.number)
         return "Member added successfully"
 
     def add_provider(self, name, number, street, city, state, zip_code):
         provider = Provider(name, number, street, city, state, zip_code)
+        if not valid_provider_number(provider.number):
+            return "Invalid provider number"
+        self._before_change("providers", provider.number)
         self.providers[provider.number] = provider
+        self.dirty_providers.add(provider.number)
+        self._reindex(self._provider_search, provider)
+        self._log("add_provider", name=name, number=number, street=street,
+                  city=city, state=state, zip_code=zip_code)
         return "Provider added successfully"
 
     def delete_member(self, member_number):
         if member_number in self.members:
+            self._before_change("members", member_number)
+            # Provider reports name the member; mark them before its records are dropped
+            self.dirty_providers.update(
+                record.provider_number
+                for record in self.service_records.member_records(member_number)
+            )
             del self.members[member_number]
+            self.service_records.drop_member(member_number)
+            self.dirty_members.discard(member_number)
+            if self._member_search is not None:
+                self._member_search.remove(member_number)
+            self._log("delete_member", member_number=member_number)
+            self._member_changed(member_number)
             return "Member deleted successfully"
         return "Member not found"
 
     def delete_provider(self, provider_number):
         if provider_number in self.providers:
+            self._before_change("providers", provider_number)
+            # Member reports name the provider
+            self.dirty_members.update(
+                record.member_number
+                for record in self.service_records.records(
+                    self.providers[provider_number].services_provided)
+            )
             del self.providers[provider_number]
+            self.dirty_providers.discard(provider_number)
+            if self._provider_search is not None:
+                self._provider_search.remove(provider_number)
+            self._log("delete_provider", provider_number=provider_number)
             return "Provider deleted successfully"
         return "Provider not found"
 
@@ -218,22 +1000,87 @@ class ChocAnSystem:
         if member_number not in self.members:
             return "Member not found"
         
+        self._before_change("members", member_number)
         member = self.members[member_number]
         for key, value in kwargs.items():
             if hasattr(member, key):
                 setattr(member, key, value)
+        self.members[member_number] = member  # write back for registry storage
+        self._reindex(self._member_search, member)
+        # Provider reports show member names too
+        self.dirty_members.add(member_number)
+        self.dirty_providers.update(
+            record.provider_number
+            for record in self.service_records.member_records(member_number)
+        )
+        self._log("update_member", member_number=member_number, **kwargs)
+        self._member_changed(member_number)
         return "Member updated successfully"
 
     def update_provider(self, provider_number, **kwargs):
         if provider_number not in self.providers:
             return "Provider not found"
-        
+        if "number" in kwargs and not valid_provider_number(str(kwargs["number"])):
+            return "Invalid provider number"
+
+        self._before_change("providers", provider_number)
         provider = self.providers[provider_number]
         for key, value in kwargs.items():
             if hasattr(provider, key):
                 setattr(provider, key, value)
+        self.providers[provider_number] = provider
+        self._reindex(self._provider_search, provider)
+        # Member reports show provider names too
+        self.dirty_providers.add(provider_number)
+        self.dirty_members.update(
+            record.member_number
+            for record in self.service_records.records(provider.services_provided)
+        )
+        self._log("update_provider", provider_number=provider_number, **kwargs)
         return "Provider updated successfully"
 
+    def _service_changed(self, code):
+        # Member reports name the service and provider reports may price it from the
+        # catalog; a re-added code names records that showed it as deleted
+        for _, member_number, provider_number, service_code, _ in self.service_records.claims(0):
+            if service_code == code:
+                self.dirty_members.add(member_number)
+                self.dirty_providers.add(provider_number)
+
+    def add_service(self, code, name, fee):
+        service = Service(code, name, fee)
+        self._before_change("services", service.code)
+        self.services[service.code] = service
+        self.catalog_version += 1
+        self._service_changed(service.code)
+        self._log("add_service", code=code, name=name, fee=fee)
+        return "Service added successfully"
+
+    def update_service(self, code, **kwargs):
+        if code not in self.services:
+            return "Service not found"
+
+        # Rebuild so the name and fee limits of Service still apply
+        self._before_change("services", code)
+        service = self.services[code]
+        self.services[code] = Service(
+            code, kwargs.get("name", service.name), kwargs.get("fee", service.fee)
+        )
+        self.catalog_version += 1
+        self._service_changed(code)
+        self._log("update_service", code=code, **kwargs)
+        return "Service updated successfully"
+
+    def delete_service(self, code):
+        if code in self.services:
+            self._before_change("services", code)
+            del self.services[code]
+            self.catalog_version += 1
+            self._service_changed(code)
+            self._log("delete_service", code=code)
+            return "Service deleted successfully"
+        return "Service not found"
+
 # Example usage and testing
 def main():
     # Initialize the system